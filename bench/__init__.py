@@ -0,0 +1,9 @@
+"""
+Офлайн-стенд для нагрузочного тестирования ботов.
+
+Состоит из поддельного Telegram Bot API (fake_telegram), заглушек сторонних
+API с настраиваемой задержкой (upstreams), сценариев синтетических апдейтов
+для каждого бота (scenarios) и генератора нагрузки с отчётом (run).
+
+Запуск: python -m bench.run bot --sessions 50 --iterations 5
+"""
@@ -0,0 +1,171 @@
+"""
+Поддельный Telegram Bot API для офлайн-нагрузки.
+
+Отдаёт боту синтетические апдейты через getUpdates (long polling с offset),
+принимает sendMessage/sendVoice/sendPhoto/editMessageText и т.п. и отмечает
+время каждого ответа по чату, чтобы генератор нагрузки мог посчитать задержку.
+"""
+import asyncio
+import itertools
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+# Методы, которые отвечают сообщением в конкретный чат
+MESSAGE_METHODS = {
+    "sendmessage", "sendvoice", "sendphoto", "senddocument", "sendaudio",
+    "sendsticker", "sendvideo", "editmessagetext", "editmessagereplymarkup",
+}
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeTelegram:
+    def __init__(self):
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._reply_counts = defaultdict(int)
+        self._waiters = {}
+        self.method_counts = defaultdict(int)
+
+        self.app = web.Application(client_max_size=32 * 1024 * 1024)
+        self.app.router.add_route("*", "/bot{token}/{method}", self._handle_method)
+        self.app.router.add_get("/file/bot{token}/{path:.*}", self._handle_file)
+
+    # --- Интерфейс для генератора нагрузки ---
+
+    def push_update(self, payload: dict) -> int:
+        """Ставит апдейт в очередь getUpdates и возвращает его update_id"""
+        update_id = next(self._update_ids)
+        payload["update_id"] = update_id
+        self._updates.append(payload)
+        self._new_updates.set()
+        return update_id
+
+    def reply_count(self, chat_id: int) -> int:
+        return self._reply_counts[chat_id]
+
+    async def wait_replies(self, chat_id: int, count: int, timeout: float) -> float:
+        """Ждёт, пока в чат придёт count ответов, и возвращает время последнего"""
+        if self._reply_counts[chat_id] >= count:
+            return time.perf_counter()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = (count, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiters.pop(chat_id, None)
+
+    # --- Обработчики HTTP ---
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.method_counts[method] += 1
+        params = await self._read_params(request)
+
+        if method == "getupdates":
+            result = await self._get_updates(params)
+        elif method == "getme":
+            result = BOT_USER
+        elif method == "getfile":
+            file_id = params.get("file_id", "file")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": 1024,
+                      "file_path": f"photos/{file_id}.jpg"}
+        elif method in MESSAGE_METHODS:
+            result = self._record_reply(params)
+        else:
+            # answerCallbackQuery, deleteWebhook, setMyCommands и прочее
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        self.method_counts["download"] += 1
+        return web.Response(body=b"\xff\xd8\xff" + b"\0" * 1021, content_type="image/jpeg")
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> dict:
+        if request.method == "GET":
+            return dict(request.query)
+        if request.content_type == "application/json":
+            return await request.json()
+
+        params = {}
+        for key, value in (await request.post()).items():
+            # Файлы (голосовые, фото) нам не нужны, достаточно факта отправки
+            params[key] = value if isinstance(value, str) else "<file>"
+        return params
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self._updates[:limit]
+
+    def _record_reply(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        self._reply_counts[chat_id] += 1
+
+        waiter = self._waiters.get(chat_id)
+        if waiter and self._reply_counts[chat_id] >= waiter[0] and not waiter[1].done():
+            waiter[1].set_result(time.perf_counter())
+
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+
+def message_update(chat_id: int, text: str = None, **fields) -> dict:
+    """Синтетический апдейт с входящим сообщением от пользователя chat_id"""
+    message = {
+        "message_id": chat_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "language_code": "ru"},
+    }
+    if text is not None:
+        message["text"] = text
+    message.update(fields)
+    return {"message": message}
+
+
+def callback_update(chat_id: int, data: str) -> dict:
+    """Синтетический апдейт с нажатием inline-кнопки"""
+    return {
+        "callback_query": {
+            "id": f"{chat_id}-{time.perf_counter_ns()}",
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": chat_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "bench",
+            },
+        }
+    }
@@ -0,0 +1,283 @@
+"""
+Генератор нагрузки: поднимает поддельный Telegram Bot API и заглушки сторонних
+API в отдельном потоке, запускает выбранного бота в основном цикле событий
+и прогоняет через него синтетические апдейты.
+
+В отчёте: пропускная способность, p50/p95/p99 задержки по каждому обработчику
+(от постановки апдейта в getUpdates до последнего ответа бота в чат),
+задержка (lag) цикла событий бота и число запросов/байт по каждому upstream.
+
+Примеры:
+    python -m bench.run bot --sessions 50 --iterations 5
+    python -m bench.run botfin --latency 0.1 --upstream-latency exchange=0.3
+    python -m bench.run all --json bench_output.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+from bench.fake_telegram import FakeTelegram
+from bench.scenarios import SCENARIOS
+from bench.upstreams import UPSTREAMS, FakeTranslator, FakeTTS, Upstreams
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOT_TOKEN = "123456:BENCH-TOKEN"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(values) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
+
+
+class ServerThread(threading.Thread):
+    """Поддельный Telegram и заглушки upstream в отдельном потоке со своим циклом событий"""
+
+    def __init__(self, latency: dict, jitter: float):
+        super().__init__(daemon=True)
+        self.latency = latency
+        self.jitter = jitter
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.telegram_url = self.upstream_url = None
+        self.fake = self.upstreams = None
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _start(self):
+        self.fake = FakeTelegram()
+        self.upstreams = Upstreams(self.latency, self.jitter)
+        self.telegram_url = await self._serve(self.fake.app)
+        self.upstream_url = await self._serve(self.upstreams.app)
+
+    @staticmethod
+    async def _serve(app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, coro):
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+async def replay(fake: FakeTelegram, module, steps, sessions: int, iterations: int, timeout: float):
+    """Прогоняет сценарий в sessions параллельных чатах iterations раз подряд"""
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    async def session(chat_id):
+        for _ in range(iterations):
+            for step in steps:
+                expected = fake.reply_count(chat_id) + step.replies
+                started = time.perf_counter()
+                fake.push_update(step.update(chat_id, module))
+                try:
+                    finished = await fake.wait_replies(chat_id, expected, timeout)
+                except asyncio.TimeoutError:
+                    errors[step.name] += 1
+                    continue
+                latencies[step.name].append(finished - started)
+
+    await asyncio.gather(*(session(10_000 + i) for i in range(sessions)))
+    return latencies, errors
+
+
+async def probe_loop_lag(samples: list, interval: float = 0.005):
+    """Меряет, насколько позже запланированного просыпается цикл событий бота"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+def prepare_module(name: str, server: ServerThread, latency: dict, workdir: str):
+    from aiogram.client.telegram import TelegramAPIServer
+
+    os.environ["BOT_TOKEN"] = BOT_TOKEN
+    os.environ.setdefault("WEATHER_API_KEY", "bench")
+    os.environ.update(server.upstreams.urls(server.upstream_url))
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module = importlib.import_module(name)
+
+    module.bot.session.api = TelegramAPIServer.from_base(server.telegram_url)
+
+    if hasattr(module, "gTTS"):
+        module.gTTS = type("BenchTTS", (FakeTTS,), {"latency": latency.get("tts", 0.0)})
+    if hasattr(module, "translator"):
+        module.translator = FakeTranslator(latency.get("translate", 0.0))
+    if hasattr(module, "DB_PATH"):
+        module.DB_PATH = os.path.join(workdir, "user.db")
+
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    return module
+
+
+async def drive(name: str, args, latency: dict) -> dict:
+    server = ServerThread(latency, args.jitter)
+    server.start()
+    server.ready.wait()
+
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    os.chdir(workdir)  # bot.py сохраняет фото в относительную папку IMG
+    module = prepare_module(name, server, latency, workdir)
+    if hasattr(module, "init_db"):
+        await module.init_db()
+
+    lag = []
+    lag_task = asyncio.create_task(probe_loop_lag(lag))
+    polling = asyncio.create_task(module.dp.start_polling(module.bot, handle_signals=False, polling_timeout=1))
+
+    started = time.perf_counter()
+    latencies, errors = await server.submit(
+        replay(server.fake, module, SCENARIOS[name], args.sessions, args.iterations, args.timeout)
+    )
+    elapsed = time.perf_counter() - started
+
+    await module.dp.stop_polling()
+    await polling
+    lag_task.cancel()
+
+    handled = sum(len(values) for values in latencies.values())
+    return {
+        "bot": name,
+        "sessions": args.sessions,
+        "iterations": args.iterations,
+        "elapsed": elapsed,
+        "throughput": handled / elapsed if elapsed else 0.0,
+        "handlers": {handler: dict(summarize(latencies[handler]), errors=errors[handler])
+                     for handler in dict.fromkeys(step.name for step in SCENARIOS[name])},
+        "loop_lag": summarize(lag),
+        "upstreams": {upstream: {"requests": server.upstreams.requests[upstream],
+                                 "bytes": server.upstreams.bytes_sent[upstream]}
+                      for upstream in sorted(server.upstreams.requests)},
+    }
+
+
+def print_report(report: dict):
+    ms = 1000
+    print(f"\n=== {report['bot']}: {report['sessions']} сессий x {report['iterations']} итераций ===")
+    print(f"Время: {report['elapsed']:.2f} с, пропускная способность: {report['throughput']:.1f} апдейтов/с")
+    print(f"{'обработчик':<28}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'ошибки':>8}")
+    for handler, stats in report["handlers"].items():
+        print(f"{handler:<28}{stats['count']:>8}{stats['p50'] * ms:>10.1f}{stats['p95'] * ms:>10.1f}"
+              f"{stats['p99'] * ms:>10.1f}{stats['max'] * ms:>10.1f}{stats['errors']:>8}")
+    lag = report["loop_lag"]
+    print(f"Лаг цикла событий: p50 {lag['p50'] * ms:.1f} мс, p99 {lag['p99'] * ms:.1f} мс, max {lag['max'] * ms:.1f} мс")
+    for upstream, stats in report["upstreams"].items():
+        print(f"upstream {upstream}: {stats['requests']} запросов, {stats['bytes']} байт")
+
+
+def parse_latency(args) -> dict:
+    latency = {upstream: args.latency for upstream in UPSTREAMS}
+    for item in args.upstream_latency:
+        upstream, _, value = item.partition("=")
+        if upstream not in UPSTREAMS:
+            raise SystemExit(f"Неизвестный upstream: {upstream}")
+        latency[upstream] = float(value)
+    return latency
+
+
+def run_all(args) -> list:
+    """Каждый бот запускается в отдельном процессе: у модулей глобальные bot и dp"""
+    reports = []
+    for name in SCENARIOS:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as output:
+            path = output.name
+        command = [sys.executable, "-m", "bench.run", name, "--json", path, "--quiet",
+                   "--sessions", str(args.sessions), "--iterations", str(args.iterations),
+                   "--latency", str(args.latency), "--jitter", str(args.jitter), "--timeout", str(args.timeout)]
+        for item in args.upstream_latency:
+            command += ["--upstream-latency", item]
+        if args.throttling:
+            command.append("--throttling")
+        if args.telegram_limits:
+            command.append("--telegram-limits")
+        if args.stall_profile:
+            root, ext = os.path.splitext(args.stall_profile)
+            command += ["--stall-profile", f"{root}_{name}{ext}"]
+        subprocess.run(command, check=True, cwd=ROOT)
+        with open(path, encoding="utf-8") as f:
+            reports.append(json.load(f))
+        os.unlink(path)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный тест ботов")
+    parser.add_argument("bot", choices=[*SCENARIOS, "all"])
+    parser.add_argument("--sessions", type=int, default=20, help="число параллельных пользователей")
+    parser.add_argument("--iterations", type=int, default=5, help="сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка всех upstream, с")
+    parser.add_argument("--upstream-latency", action="append", default=[], metavar="NAME=SECONDS",
+                        help=f"задержка отдельного upstream ({', '.join(UPSTREAMS)})")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержки upstream, доля")
+    parser.add_argument("--timeout", type=float, default=30.0, help="сколько ждать ответа бота, с")
+    parser.add_argument("--stall-profile", metavar="PATH",
+                        help="включить детектор зависаний и сохранить folded-стеки в PATH")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="не снимать лимиты Telegram в общей очереди исходящих сообщений")
+    parser.add_argument("--throttling", action="store_true",
+                        help="не отключать ограничение частоты (сценарии упрутся в лимиты)")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    parser.add_argument("--quiet", action="store_true", help="не печатать отчёт")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)  # бот работает во временной папке
+    if not args.throttling:
+        os.environ["THROTTLING"] = "0"
+    if not args.telegram_limits:
+        # Синтетические пользователи пишут быстрее, чем Telegram разрешает отвечать в чат
+        os.environ["OUTBOUND_GLOBAL_RATE"] = os.environ["OUTBOUND_CHAT_RATE"] = "1000000"
+    if args.stall_profile:
+        os.environ["STALL_PROFILE"] = "1"
+        os.environ["STALL_REPORT"] = os.path.abspath(args.stall_profile)
+
+    if args.bot == "all":
+        reports = run_all(args)
+    else:
+        reports = [asyncio.run(drive(args.bot, args, parse_latency(args)))]
+
+    if not args.quiet:
+        for report in reports:
+            print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports if args.bot == "all" else reports[0], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Сценарии синтетических апдейтов для каждого бота.
+
+Сценарий - это последовательность шагов одного пользователя. Шаг подписан
+именем обработчика, который должен его обработать, и числом ответов в чат,
+которые бот на него отправляет (например, handle_text в bot.py отвечает
+двумя голосовыми сообщениями). Если один обработчик встречается в сценарии
+в разных ролях, у шага есть своя подпись (label) для отчёта.
+"""
+from typing import Callable, NamedTuple
+
+from bench.fake_telegram import callback_update, message_update
+
+
+class Step(NamedTuple):
+    handler: str
+    update: Callable  # (chat_id, module) -> dict
+    replies: int = 1
+    label: str = None
+
+    @property
+    def name(self) -> str:
+        return self.label or self.handler
+
+
+def text(handler: str, value: str, replies: int = 1, label: str = None) -> Step:
+    return Step(handler, lambda chat_id, module: message_update(chat_id, value), replies, label)
+
+
+def photo(handler: str) -> Step:
+    def update(chat_id, module):
+        return message_update(chat_id, photo=[{
+            "file_id": f"photo{chat_id}", "file_unique_id": f"photo{chat_id}", "width": 640, "height": 480,
+        }])
+    return Step(handler, update)
+
+
+def voice(handler: str, replies: int = 1) -> Step:
+    def update(chat_id, module):
+        return message_update(chat_id, voice={"file_id": f"voice{chat_id}", "file_unique_id": f"voice{chat_id}",
+                                              "duration": 3})
+    return Step(handler, update, replies)
+
+
+def location(handler: str, replies: int = 1) -> Step:
+    def update(chat_id, module):
+        return message_update(chat_id, location={"latitude": 55.75, "longitude": 37.62})
+    return Step(handler, update, replies)
+
+
+def callback(handler: str, data: Callable) -> Step:
+    """data(module) возвращает callback_data, собранную самим ботом"""
+    return Step(handler, lambda chat_id, module: callback_update(chat_id, data(module)))
+
+
+SCENARIOS = {
+    "bot": [
+        text("cmd_start", "/start"),
+        text("cmd_help", "/help"),
+        text("cmd_forecast", "/forecast"),
+        text("get_weather", "Москва"),
+        text("cmd_forecast", "/forecast Москва, Париж, Берлин", label="cmd_forecast[3 города]"),
+        text("cmd_favorites", "/favorites Лондон, Рим", label="cmd_favorites[сохранить]"),
+        text("cmd_favorites", "/favorites", label="cmd_favorites[прогноз]"),
+        text("handle_text", "Привет", replies=2),
+        photo("handle_photo"),
+        voice("handle_voice"),
+        location("echo"),
+    ],
+    "bot3": [
+        text("cmd_start", "/start"),
+        text("translate_message", "Привет, как дела?"),
+    ],
+    "bot4": [
+        text("cmd_start", "/start"),
+        text("cmd_help", "/help"),
+        text("handle_greetings", "Привет"),
+        text("cmd_links", "/links"),
+        text("cmd_dynamic", "/dynamic"),
+        callback("show_more_options", lambda m: m.pack(m.MENU_DYNAMIC, m.ACTION_SHOW_MORE)),
+        callback("handle_option", lambda m: m.pack(m.MENU_DYNAMIC, m.ACTION_SELECT, 1)),
+    ],
+    "botmaster_aiogram": [
+        text("cmd_start", "/start"),
+        text("cmd_fact", "/fact"),
+        text("cmd_bored", "/bored"),
+        text("cmd_cat", "/cat"),
+        text("cmd_joke", "/joke"),
+        text("cmd_pokemon", "/pokemon pikachu"),
+    ],
+    "botfin": [
+        text("send_start", "/start"),
+        text("consent", "Дать согласие на обработку персональных данных"),
+        text("registration", "Регистрация в телеграм боте"),
+        text("exchange_rates", "Курс валют"),
+        text("send_tips", "Советы по экономии"),
+        text("finances", "Личные финансы"),
+        text("process_category1", "Еда"),
+        text("process_expenses1", "1500"),
+        text("process_category2", "Транспорт"),
+        text("process_expenses2", "700.5"),
+        text("process_category3", "Связь"),
+        text("process_expenses3", "450"),
+        text("expenses_report", "Отчёт о расходах"),
+    ],
+}
@@ -0,0 +1,189 @@
+"""
+Заглушки сторонних API, которые вызывают боты.
+
+Все заглушки обслуживаются одним aiohttp-приложением, у каждой своя задержка
+(latency) и свой счётчик запросов и отданных байт. Ответы повторяют структуру
+настоящих API настолько, насколько это нужно обработчикам ботов.
+
+gTTS и googletrans жёстко ходят на https://translate.google.*, поэтому для них
+вместо HTTP-заглушек есть подменные классы FakeTTS и FakeTranslator с той же
+задержкой и тем же характером ожидания (gTTS блокирует поток, googletrans - нет).
+"""
+import asyncio
+import io
+import json
+import random
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from aiohttp import web
+
+UPSTREAMS = ("weather", "exchange", "joke", "bored", "facts", "cat", "pokemon", "tts", "translate")
+
+_WEATHER_PATH = "/VisualCrossingWebServices/rest/services/timeline/"
+
+_DAY_FIELDS = {
+    "tempmax": 12.4, "tempmin": 3.1, "temp": 7.8, "feelslikemax": 11.0, "feelslikemin": 0.4,
+    "feelslike": 5.2, "dew": 1.9, "humidity": 71.3, "precip": 0.2, "precipprob": 35.0,
+    "precipcover": 8.3, "preciptype": ["rain"], "snow": 0.0, "snowdepth": 0.0, "windgust": 31.7,
+    "windspeed": 18.4, "winddir": 221.6, "pressure": 1012.8, "cloudcover": 64.5,
+    "visibility": 23.1, "solarradiation": 96.2, "solarenergy": 8.3, "uvindex": 4,
+    "severerisk": 10, "sunrise": "07:12:44", "sunset": "18:03:27", "moonphase": 0.48,
+    "conditions": "Дождь, Переменная облачность",
+    "description": "Переменная облачность, днём возможен небольшой дождь.",
+    "icon": "rain", "stations": ["UUEE", "UUWW", "UUDD"], "source": "comb",
+}
+
+
+def weather_payload(city: str, days_count: int = 15, include: set = None, elements: set = None) -> dict:
+    """
+    Ответ timeline-эндпоинта. По умолчанию полный, как у настоящего API: 15 дней
+    по 24 часа. include и elements урезают ответ так же, как параметры API.
+    """
+    days = []
+    for day in range(days_count):
+        hours = [dict(_DAY_FIELDS, datetime=f"{hour:02d}:00:00", datetimeEpoch=1700000000 + day * 86400 + hour * 3600)
+                 for hour in range(24)]
+        days.append(dict(_DAY_FIELDS, datetime=f"2026-10-{day + 1:02d}",
+                         datetimeEpoch=1700000000 + day * 86400, hours=hours))
+    payload = {
+        "queryCost": 1, "latitude": 55.75, "longitude": 37.62,
+        "resolvedAddress": f"{city}, Россия", "address": city,
+        "timezone": "Europe/Moscow", "tzoffset": 3.0,
+        "description": "Похолодание во второй половине недели.",
+        "days": days,
+        "alerts": [],
+        "stations": {code: {"distance": 20000.0, "latitude": 55.9, "longitude": 37.4,
+                            "useCount": 0, "id": code, "name": code, "quality": 50, "contribution": 0.0}
+                     for code in ("UUEE", "UUWW", "UUDD")},
+        "currentConditions": dict(_DAY_FIELDS, datetime="12:00:00", datetimeEpoch=1700043200),
+    }
+
+    if include:
+        sections = {"days": "days", "current": "currentConditions", "alerts": "alerts", "stations": "stations"}
+        for name, key in sections.items():
+            if name not in include:
+                del payload[key]
+        if "hours" not in include:
+            for day in payload.get("days", ()):
+                del day["hours"]
+    if elements:
+        for day in payload.get("days", ()):
+            for key in [key for key in day if key not in elements]:
+                del day[key]
+    return payload
+
+
+class Upstreams:
+    def __init__(self, latency: dict, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = defaultdict(int)
+        self.bytes_sent = defaultdict(int)
+
+        self.app = web.Application()
+        self.app.router.add_get(_WEATHER_PATH + "{city:.*}", self._weather)
+        self.app.router.add_get("/v6/{key}/latest/{base}", self._exchange)
+        self.app.router.add_get("/joke/{category}", self._joke)
+        self.app.router.add_get("/bored/api/activity", self._bored)
+        self.app.router.add_get("/random.json", self._facts)
+        self.app.router.add_get("/v1/images/search", self._cat)
+        self.app.router.add_get("/api/v2/pokemon/{name}", self._pokemon)
+
+    def urls(self, base: str) -> dict:
+        """Переменные окружения, которые направляют ботов на заглушки"""
+        return {
+            "WEATHER_BASE_URL": base,
+            "EXCHANGE_RATES_URL": f"{base}/v6/bench/latest/USD",
+            "JOKE_API_URL": f"{base}/joke/Any?safe-mode",
+            "BORED_API_URL": f"{base}/bored/api/activity",
+            "FACTS_API_URL": f"{base}/random.json?language=ru",
+            "CAT_API_URL": f"{base}/v1/images/search",
+            "POKEMON_API_URL": f"{base}/api/v2/pokemon",
+        }
+
+    def delay(self, name: str) -> float:
+        latency = self.latency.get(name, 0.0)
+        if self.jitter:
+            latency *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return latency
+
+    async def _respond(self, name: str, payload, status: int = 200) -> web.Response:
+        self.requests[name] += 1
+        await asyncio.sleep(self.delay(name))
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.bytes_sent[name] += len(body)
+        return web.Response(body=body, status=status, content_type="application/json")
+
+    async def _weather(self, request: web.Request) -> web.Response:
+        # /timeline/{город}[/{дата1}[/{дата2}]]: с одной датой - ровно один день
+        city, *dates = request.match_info["city"].split("/")
+        include = set(filter(None, request.query.get("include", "").split(",")))
+        elements = set(filter(None, request.query.get("elements", "").split(",")))
+        return await self._respond("weather", weather_payload(city, 1 if len(dates) == 1 else 15, include, elements))
+
+    async def _exchange(self, request: web.Request) -> web.Response:
+        rates = {f"C{i:02d}": 1.0 + i / 10 for i in range(160)}
+        rates.update({"USD": 1.0, "EUR": 0.92, "RUB": 81.5})
+        return await self._respond("exchange", {
+            "result": "success", "base_code": request.match_info["base"],
+            "time_last_update_unix": int(time.time()), "conversion_rates": rates,
+        })
+
+    async def _joke(self, request: web.Request) -> web.Response:
+        return await self._respond("joke", {
+            "error": False, "category": "Programming", "type": "twopart",
+            "setup": "Why do programmers prefer dark mode?",
+            "delivery": "Because light attracts bugs.", "safe": True, "id": 1, "lang": "en",
+        })
+
+    async def _bored(self, request: web.Request) -> web.Response:
+        return await self._respond("bored", {
+            "activity": "Learn a new programming language", "type": "education",
+            "participants": 1, "price": 0.1, "key": "5881028",
+        })
+
+    async def _facts(self, request: web.Request) -> web.Response:
+        return await self._respond("facts", {
+            "id": "bench", "text": "Улитка может спать три года.", "source": "bench",
+            "language": "ru", "permalink": "https://example.invalid/bench",
+        })
+
+    async def _cat(self, request: web.Request) -> web.Response:
+        return await self._respond("cat", [
+            {"id": "bench", "url": "https://cdn2.thecatapi.com/images/bench.jpg", "width": 640, "height": 480}
+        ])
+
+    async def _pokemon(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        return await self._respond("pokemon", {
+            "name": name, "height": 4, "weight": 60,
+            "abilities": [{"ability": {"name": n}} for n in ("static", "lightning-rod")],
+            "types": [{"type": {"name": "electric"}}],
+            "sprites": {"other": {"official-artwork": {"front_default": "https://example.invalid/25.png"}}},
+        })
+
+
+class FakeTTS:
+    """Подмена gTTS: так же блокирует поток на время "сетевого" запроса"""
+
+    latency = 0.0
+
+    def __init__(self, text, lang="ru", slow=False, tld="com"):
+        self.text = text
+
+    def write_to_fp(self, fp: io.BytesIO):
+        time.sleep(self.latency)
+        fp.write(b"ID3" + b"\0" * 2048)
+
+
+class FakeTranslator:
+    """Подмена асинхронного googletrans.Translator"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def translate(self, text, dest="en", src="auto"):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(text=text, src=src, dest=dest)
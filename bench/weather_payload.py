@@ -0,0 +1,59 @@
+"""
+Сравнение полного и урезанного ответа Visual Crossing.
+
+"До": полный timeline-ответ (15 дней по 24 часа), json.loads, в кэше весь словарь.
+"После": только сегодняшний день и нужные поля (как запрашивает bot.py),
+разбор через bot.json_loads (orjson, если установлен), в кэше - запись Forecast.
+
+Запуск: python -m bench.weather_payload
+"""
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from bench.run import BOT_TOKEN, ROOT
+from bench.upstreams import weather_payload
+
+CACHE_ENTRIES = 200
+
+
+def cache_size(make_entry) -> float:
+    """Сколько байт памяти занимает одна запись кэша"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    cache = {f"город{i}": make_entry(i) for i in range(CACHE_ENTRIES)}
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del cache
+    return size / CACHE_ENTRIES
+
+
+def main():
+    os.environ.setdefault("BOT_TOKEN", BOT_TOKEN)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import bot
+
+    full = json.dumps(weather_payload("Москва"), ensure_ascii=False).encode()
+    lean = json.dumps(weather_payload("Москва", 1, {"days"}, set(bot.WEATHER_ELEMENTS.split(","))),
+                      ensure_ascii=False).encode()
+
+    runs = 200
+    full_parse = timeit.timeit(lambda: json.loads(full), number=runs) / runs
+    lean_parse = timeit.timeit(lambda: bot.parse_forecast("Москва", lean), number=runs) / runs
+
+    full_entry = cache_size(lambda i: json.loads(full))
+    lean_entry = cache_size(lambda i: bot.parse_forecast("Москва", lean))
+
+    print(f"{'':<26}{'до':>14}{'после':>14}")
+    print(f"{'байт в ответе':<26}{len(full):>14}{len(lean):>14}")
+    print(f"{'разбор ответа, мкс':<26}{full_parse * 1e6:>14.1f}{lean_parse * 1e6:>14.1f}")
+    print(f"{'память записи кэша, байт':<26}{full_entry:>14.0f}{lean_entry:>14.0f}")
+    print(f"JSON-парсер: {getattr(bot.json_loads, '__module__', None) or bot.json_loads.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import os
+import json
+import time
 import logging
-import requests
 import urllib.parse
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
@@ -12,6 +13,21 @@ from gtts import gTTS
 import tempfile
 from googletrans import Translator  # Нужно установить: pip install googletrans==4.0.0-rc1
 import asyncio
+from typing import NamedTuple
+import aiohttp
+import aiosqlite
+
+try:
+    import orjson  # Быстрый разбор JSON, если установлен: pip install orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+import metrics
+import outbound
+import stall_profiler
+import subscriptions
+import throttling
 
 
 # Загрузка переменных окружения
@@ -22,14 +38,137 @@ logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=os.getenv("BOT_TOKEN"))
+outbound.install(bot)
 dp = Dispatcher()
+metrics.install(dp)
+stall_profiler.install(dp)
 
 # Инициализация переводчика
 translator = Translator()
 
-# OpenWeatherMap API
+# Visual Crossing API (адрес можно переопределить, например, для нагрузочного теста)
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
-WEATHER_URL = "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{city}?key={WEATHER_API_KEY}"
+WEATHER_BASE_URL = os.getenv("WEATHER_BASE_URL", "https://weather.visualcrossing.com")
+# Запрашиваем только сегодняшний день и только те поля, которые показываем
+WEATHER_URL = WEATHER_BASE_URL + "/VisualCrossingWebServices/rest/services/timeline/{city}/today"
+WEATHER_ELEMENTS = "datetime,temp,humidity,windspeed,conditions,description"
+
+WEATHER_PARAMS = {
+    'key': WEATHER_API_KEY,
+    'unitGroup': 'metric',
+    'include': 'days',
+    'elements': WEATHER_ELEMENTS,
+    'lang': 'ru'
+}
+
+# Сколько городов можно запросить за раз и сколько из них запрашивать одновременно
+MAX_CITIES = 10
+FORECAST_FANOUT = int(os.getenv("FORECAST_FANOUT") or 4)
+
+# Потолок одновременных запросов к погодному API на весь бот. Один /forecast
+# делает до MAX_CITIES запросов, поэтому ограничение действует на каждый запрос
+# в fetch_weather, а не на вызов обработчика.
+WEATHER_CONCURRENCY = 10
+weather_slots = asyncio.Semaphore(WEATHER_CONCURRENCY)
+
+# Ответы API по городам живут недолго: повторные запросы того же города идут из кэша
+WEATHER_CACHE_TTL = 600
+WEATHER_CACHE_LIMIT = 1000
+weather_cache = {}  # город -> (момент истечения, Forecast)
+
+# Последние прогнозы по городам: их отдаём, если пользователь упёрся в ограничение частоты
+last_forecasts = {}
+LAST_FORECASTS_LIMIT = 1000
+
+# Избранные города пользователей
+DB_PATH = 'weather.db'
+
+# Общая HTTP-сессия для запросов погоды (создаётся при запуске бота)
+http_session = None
+
+# Смещение местного времени подписчиков по умолчанию, минуты (Москва - UTC+3)
+SUBSCRIPTION_UTC_OFFSET = int(os.getenv("SUBSCRIPTION_UTC_OFFSET") or 180)
+background_tasks = []
+
+
+def cached_forecasts_text(message: types.Message):
+    """Последние прогнозы по всем городам из сообщения (или аргументов команды), если они есть"""
+    text = message.text or ""
+    if text.startswith("/"):
+        text = text.split(maxsplit=1)[1] if " " in text.strip() else ""
+    found = [last_forecasts[city.lower()] for city in parse_cities(text)
+             if city.lower() in last_forecasts]
+    return "\n\n".join(found) or None
+
+
+# Ограничение частоты запросов к погодному API и синтезу речи. Команды погоды
+# списывают токен на каждый город, которого нет в кэше (quota=True, см. send_forecasts),
+# одновременные запросы погоды ограничивает weather_slots в fetch_weather.
+throttling.install(dp, {
+    "get_weather": throttling.Rule(rate=1 / 10, burst=3, fallback=cached_forecasts_text, quota=True),
+    "cmd_forecast": throttling.Rule(rate=1 / 10, burst=3, fallback=cached_forecasts_text, quota=True),
+    "cmd_favorites": throttling.Rule(rate=1 / 10, burst=3, quota=True),
+    "cmd_subscribe": throttling.Rule(rate=1 / 10, burst=3),
+    "handle_text": throttling.Rule(rate=1 / 5, burst=3, upstream="tts"),
+    "echo": throttling.Rule(rate=1 / 5, burst=3, upstream="tts"),
+}, upstream_limits={"tts": 4})
+
+
+class WeatherError(Exception):
+    """Ошибка запроса погоды, текст которой можно показать пользователю"""
+
+
+class Forecast(NamedTuple):
+    """Только то, что показываем пользователю: компактнее словаря с ответом API"""
+    location: str
+    temp: float
+    description: str
+    humidity: float
+    wind: float
+
+
+@dp.startup()
+async def on_startup():
+    global http_session
+    http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+
+    async with connect_db() as db:
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS favorites (
+                user_id INTEGER PRIMARY KEY,
+                cities TEXT NOT NULL
+            )
+        ''')
+        await db.commit()
+
+    await scheduler.init_db()
+    background_tasks.append(asyncio.create_task(scheduler.run()))
+
+
+@dp.shutdown()
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    if http_session is not None:
+        await http_session.close()
+
+
+def connect_db():
+    return metrics.TimedConnection(aiosqlite.connect(DB_PATH))
+
+
+def remember(cache: dict, limit: int, key, value):
+    """Кладёт значение в словарь-кэш, вытесняя самую старую запись при переполнении"""
+    cache[key] = value
+    if len(cache) > limit:
+        del cache[next(iter(cache))]
+
+
+def parse_cities(text: str) -> list:
+    """Разбирает список городов через запятую, убирая пустые и повторы"""
+    cities = dict.fromkeys(city.strip() for city in text.split(",") if city.strip())
+    return list(cities)[:MAX_CITIES]
 
 
 # Состояния для FSM
@@ -51,71 +190,242 @@ async def cmd_help(message: types.Message):
         "/start — начать работу\n"
         "/help — получить помощь\n"
         "/forecast — получить прогноз погоды (введи название города)\n"
+        "/forecast Москва, Париж — прогноз сразу для нескольких городов\n"
+        "/favorites Москва, Париж — сохранить избранные города, /favorites — прогноз по ним\n"
+        "/subscribe Москва 08:00 — присылать прогноз каждый день в 08:00 (по Москве, или укажи UTC+5)\n"
+        "/unsubscribe Москва — отменить подписку (без города — все подписки)\n"
         "Также я могу сохранять присланные мне фото в папку IMG и отправлять голосовые соообщения!"
     )
 
 
-# Команда /forecast
+# Команда /forecast: без аргументов спрашивает город, с аргументами - сразу присылает прогноз
 @dp.message(Command("forecast"))
-async def cmd_forecast(message: types.Message, state: FSMContext):
-    await message.answer("Введите название города:")
+async def cmd_forecast(message: types.Message, state: FSMContext, quota: throttling.Quota = None):
+    args = message.text.split(maxsplit=1)
+    if len(args) > 1 and parse_cities(args[1]):
+        # Города указаны сразу: незаконченный ввод после прошлого /forecast больше не ждём
+        await state.clear()
+        await send_forecasts(message, parse_cities(args[1]), quota)
+        return
+
+    await message.answer("Введите название города (или несколько через запятую):")
     await state.set_state(WeatherStates.waiting_for_city)
 
 
-# Обработка введённого города
+# Обработка введённого города (или нескольких)
 @dp.message(WeatherStates.waiting_for_city)
-async def get_weather(message: types.Message, state: FSMContext):
-    city = message.text.strip()
-    encoded_city = urllib.parse.quote(city)
-
-    url = f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{encoded_city}"
-    params = {
-        'key': WEATHER_API_KEY,
-        'unitGroup': 'metric',
-        'include': 'current',  # или 'days'
-        'lang': 'ru'
-    }
-
+async def get_weather(message: types.Message, state: FSMContext, quota: throttling.Quota = None):
     try:
-        response = requests.get(url, params=params)
-        print(f"Статус: {response.status_code}")
-        print(f"Ответ: {response.text[:300]}...")  # Печатаем начало ответа для отладки
+        cities = parse_cities(message.text or "")
+        if not cities:
+            await message.answer("❗ Укажите хотя бы один город.")
+            return
+        await send_forecasts(message, cities, quota)
+    finally:
+        await state.clear()
+
 
-        if response.status_code != 200:
-            await message.answer("❌ Ошибка: неверный ключ или город не найден.")
+# Команда /favorites: с аргументами сохраняет избранные города, без - присылает прогноз по ним
+@dp.message(Command("favorites"))
+async def cmd_favorites(message: types.Message, quota: throttling.Quota = None):
+    user_id = message.from_user.id
+    args = message.text.split(maxsplit=1)
+
+    async with connect_db() as db:
+        if len(args) > 1 and parse_cities(args[1]):
+            cities = parse_cities(args[1])
+            await db.execute(
+                'INSERT OR REPLACE INTO favorites (user_id, cities) VALUES (?, ?)',
+                (user_id, ", ".join(cities))
+            )
+            await db.commit()
+            await message.answer(f"⭐ Избранные города сохранены: {', '.join(cities)}")
             return
 
-        data = response.json()
-
-        # Извлечение данных
-        location = data.get("resolvedAddress", city)
-        today = data["days"][0]
-        temp = today["temp"]
-        desc = today.get("description", today["conditions"])
-        humidity = today["humidity"]
-        wind = today["windspeed"]
-
-        msg = (
-            f"🌍 Местоположение: {location}\n"
-            f"🌡 Температура: {temp} °C\n"
-            f"☁ Погода: {desc}\n"
-            f"💧 Влажность: {humidity}%\n"
-            f"💨 Ветер: {wind} км/ч"
-        )
-        await message.answer(msg)
+        cursor = await db.execute('SELECT cities FROM favorites WHERE user_id = ?', (user_id,))
+        row = await cursor.fetchone()
+
+    if not row:
+        await message.answer("⭐ Избранных городов пока нет. Сохраните их: /favorites Москва, Париж")
+        return
+    await send_forecasts(message, parse_cities(row[0]), quota)
+
+
+async def send_forecasts(message: types.Message, cities: list, quota: throttling.Quota = None):
+    """
+    Запрашивает прогноз по всем городам одновременно (не больше FORECAST_FANOUT
+    запросов сразу) и отправляет все прогнозы одним сообщением (несколькими,
+    если не помещаются): отдельные сообщения упирались бы в лимит чата.
+    Ошибка по одному городу не мешает остальным.
 
-    except requests.exceptions.RequestException as e:
-        await message.answer("📡 Ошибка сети. Попробуйте позже.")
-        print("Ошибка сети:", e)
+    Каждый город, которого нет в кэше, стоит пользователю одного токена quota;
+    на города сверх оставшихся токенов отвечаем последним сохранённым прогнозом
+    или отказом, не обращаясь к API.
+    """
+    texts = []
+    if quota is not None:
+        uncached = [city for city in cities if cached_forecast(city) is None]
+        throttled = uncached[quota.take(len(uncached)):]
+        texts += [last_forecasts.get(city.lower()) or f"{throttling.THROTTLED_TEXT} ({city})" for city in throttled]
+        cities = [city for city in cities if city not in throttled]
+
+    semaphore = asyncio.Semaphore(FORECAST_FANOUT)
+
+    async def forecast(city):
+        async with semaphore:
+            return await forecast_text(city)
+
+    texts += await asyncio.gather(*(forecast(city) for city in cities))
+    for text in outbound.join_texts(texts):
+        await message.answer(text)
+
+
+async def forecast_text(city: str) -> str:
+    """Текст прогноза для одного города или понятное сообщение об ошибке"""
+    try:
+        msg = render_weather(await fetch_weather(city))
+        remember(last_forecasts, LAST_FORECASTS_LIMIT, city.lower(), msg)
+        return msg
+    except WeatherError as e:
+        return f"{e} ({city})"
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.error(f"Ошибка сети: {e}")
+        return f"📡 Ошибка сети. Попробуйте позже. ({city})"
     except ValueError as e:  # JSON decode error
-        await message.answer("📄 Получен некорректный ответ от сервера.")
-        print("Ошибка JSON:", e)
-        print("Текст ответа:", response.text)
+        logging.error(f"Ошибка JSON: {e}")
+        return f"📄 Получен некорректный ответ от сервера. ({city})"
     except Exception as e:
-        await message.answer("⚠ Неизвестная ошибка.")
-        print("Ошибка:", e)
-    finally:
-        await state.clear()
+        logging.error(f"Ошибка: {e}")
+        return f"⚠ Неизвестная ошибка. ({city})"
+
+
+async def fetch_weather(city: str, wait: bool = False) -> Forecast:
+    """
+    Прогноз Visual Crossing на сегодня по городу (из кэша, если он ещё свежий).
+    Если все weather_slots заняты, ответ пользователю не ждёт в очереди, а сразу
+    получает отказ; рассылка (wait=True) дожидается свободного слота.
+    """
+    forecast = cached_forecast(city)
+    if forecast is not None:
+        metrics.cache_hit("weather")
+        return forecast
+    metrics.cache_miss("weather")
+
+    if not wait and weather_slots.locked():
+        throttling.THROTTLED.inc("fetch_weather", "upstream")
+        raise WeatherError(throttling.BUSY_TEXT)
+
+    url = WEATHER_URL.format(city=urllib.parse.quote(city))
+    async with weather_slots:
+        with metrics.upstream("weather"):
+            async with http_session.get(url, params=WEATHER_PARAMS) as response:
+                status = response.status
+                body = await response.read()
+
+    # Начало ответа для отладки пишем в лог только для небольшой доли запросов
+    metrics.log_sampled(logging.getLogger(__name__), "weather_response",
+                        city=city, status=status, body=body[:300].decode(errors="replace"))
+
+    if status != 200:
+        metrics.UPSTREAM_ERRORS.inc("weather")
+        raise WeatherError("❌ Ошибка: неверный ключ или город не найден.")
+
+    forecast = parse_forecast(city, body)
+    remember(weather_cache, WEATHER_CACHE_LIMIT, city.lower(), (time.monotonic() + WEATHER_CACHE_TTL, forecast))
+    return forecast
+
+
+def cached_forecast(city: str):
+    """Прогноз из кэша, если он ещё свежий, иначе None"""
+    cached = weather_cache.get(city.lower())
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def parse_forecast(city: str, body: bytes) -> Forecast:
+    data = json_loads(body)
+
+    # Извлечение данных
+    today = data["days"][0]
+    return Forecast(
+        location=data.get("resolvedAddress", city),
+        temp=today["temp"],
+        description=today.get("description") or today["conditions"],
+        humidity=today["humidity"],
+        wind=today["windspeed"],
+    )
+
+
+def render_weather(forecast: Forecast) -> str:
+    return (
+        f"🌍 Местоположение: {forecast.location}\n"
+        f"🌡 Температура: {forecast.temp} °C\n"
+        f"☁ Погода: {forecast.description}\n"
+        f"💧 Влажность: {forecast.humidity}%\n"
+        f"💨 Ветер: {forecast.wind} км/ч"
+    )
+
+
+async def send_bulk(user_id: int, text: str):
+    # Рассылка уступает очередь ответам пользователям
+    with outbound.bulk():
+        await bot.send_message(user_id, text)
+
+
+# Ежедневная рассылка прогнозов по подпискам: один запрос к API на город
+scheduler = subscriptions.SubscriptionScheduler(
+    connect=connect_db,
+    fetch=lambda city: fetch_weather(city, wait=True),
+    render=lambda city, forecast, lang: render_weather(forecast),  # шаблон пока только русский
+    send=send_bulk,
+    fanout=FORECAST_FANOUT,
+    send_rate=None,  # темп рассылки задаёт общая очередь outbound
+)
+
+
+# Команда /subscribe: без аргументов показывает подписки, с аргументами - оформляет новую
+@dp.message(Command("subscribe"))
+async def cmd_subscribe(message: types.Message):
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        current = await scheduler.list_for_user(message.from_user.id)
+        lines = [f"• {s.city} в {s.local_time} (UTC{s.utc_offset / 60:+g})" for s in current]
+        await message.answer(
+            ("Ваши подписки:\n" + "\n".join(lines) + "\n\n" if lines else "")
+            + "❗ Формат: /subscribe <город> <ЧЧ:ММ> [UTC+3]. Например: /subscribe Москва 08:00"
+        )
+        return
+
+    subscription = subscriptions.parse_subscription(args[1], SUBSCRIPTION_UTC_OFFSET)
+    if subscription is None:
+        await message.answer("❗ Формат: /subscribe <город> <ЧЧ:ММ> [UTC+3]. Например: /subscribe Москва 08:00")
+        return
+
+    # Город проверяем сразу: с опечаткой рассылка каждый день молча не удавалась бы
+    try:
+        await fetch_weather(subscription.city, wait=True)
+    except WeatherError:
+        await message.answer(f"❌ Не удалось найти город {subscription.city}. Проверьте название.")
+        return
+    except Exception as e:
+        logging.error(f"Не удалось проверить город для подписки ({subscription.city}): {e}")
+        await message.answer("📡 Не удалось проверить город. Попробуйте позже.")
+        return
+
+    await scheduler.subscribe(message.from_user.id, subscription)
+    await message.answer(f"🔔 Буду присылать прогноз для {subscription.city} каждый день в {subscription.local_time}.")
+
+
+# Команда /unsubscribe: отменяет подписку на город или все подписки
+@dp.message(Command("unsubscribe"))
+async def cmd_unsubscribe(message: types.Message):
+    args = message.text.split(maxsplit=1)
+    removed = await scheduler.unsubscribe(message.from_user.id, args[1] if len(args) > 1 else None)
+    if removed:
+        await message.answer("🔕 Подписка отменена.")
+    else:
+        await message.answer("У вас нет такой подписки.")
 
 
 # Функция для создания голосового сообщения
@@ -125,7 +435,8 @@ async def create_voice_message(text: str, lang: str = 'ru') -> io.BytesIO:
 
     # Создаем временный файл в памяти
     voice_buffer = io.BytesIO()
-    tts.write_to_fp(voice_buffer)
+    with metrics.upstream("tts"):
+        tts.write_to_fp(voice_buffer)
     voice_buffer.seek(0)
 
     return voice_buffer
@@ -6,6 +6,11 @@ from googletrans import Translator
 from dotenv import load_dotenv
 import logging
 
+import metrics
+import outbound
+import stall_profiler
+import throttling
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -14,7 +19,15 @@ logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=os.getenv("BOT_TOKEN"))
+outbound.install(bot)
 dp = Dispatcher()
+metrics.install(dp)
+stall_profiler.install(dp)
+
+# Ограничение частоты запросов к переводчику
+throttling.install(dp, {
+    "translate_message": throttling.Rule(rate=1 / 2, burst=5, upstream="translate"),
+}, upstream_limits={"translate": 10})
 
 # Инициализация переводчика
 translator = Translator()
@@ -30,11 +43,12 @@ async def translate_message(message: Message):
     if message.text:
         try:
             # Переводим текст на английский (асинхронно)
-            translated = await translator.translate(message.text, dest='en')
+            with metrics.upstream("translate"):
+                translated = await translator.translate(message.text, dest='en')
             await message.answer(f"Перевод на английский:\n{translated.text}")
         except Exception as e:
             await message.answer("Произошла ошибка при переводе. Попробуйте позже.")
-            print(f"Ошибка перевода: {e}")  # Для отладки
+            logging.error(f"Ошибка перевода: {e}")
     else:
         await message.answer("Пожалуйста, отправь текстовое сообщение.")
 
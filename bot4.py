@@ -6,6 +6,11 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMar
 from aiogram.utils.markdown import hbold
 from dotenv import load_dotenv
 
+import metrics
+import outbound
+import stall_profiler
+from callback_codec import CallbackPayload, callback_filter, pack
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -14,7 +19,54 @@ logging.basicConfig(level=logging.INFO)
 
 # Инициализируем бота и диспетчер
 bot = Bot(token=os.getenv("BOT_TOKEN"))
+outbound.install(bot)
 dp = Dispatcher()
+metrics.install(dp)
+stall_profiler.install(dp)
+
+# Идентификаторы меню и действий для callback_data (см. callback_codec.py)
+MENU_DYNAMIC = 1
+
+ACTION_SHOW_MORE = 1
+ACTION_SELECT = 2
+ACTION_BACK = 3
+
+DYNAMIC_OPTIONS = (1, 2)
+
+
+# Реестр статических клавиатур: собираем один раз при запуске,
+# а не на каждый вызов обработчика
+KEYBOARDS = {
+    "start": ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="Привет"), KeyboardButton(text="Пока")]
+        ],
+        resize_keyboard=True,  # Подстраивает размер кнопок под экран
+        one_time_keyboard=False  # Кнопки остаются после нажатия
+    ),
+    "links": InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="📰 Новости", url="https://news.yandex.ru")],
+            [InlineKeyboardButton(text="🎵 Музыка", url="https://music.yandex.ru")],
+            [InlineKeyboardButton(text="🎬 Видео", url="https://youtube.com")]
+        ]
+    ),
+    "dynamic": InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="Показать больше опций",
+                                  callback_data=pack(MENU_DYNAMIC, ACTION_SHOW_MORE))]
+        ]
+    ),
+    # Номер опции едет в самой кнопке, поэтому на сервере ничего не храним
+    "dynamic_options": InlineKeyboardMarkup(
+        inline_keyboard=[
+            *[[InlineKeyboardButton(text=f"Опция {option}",
+                                    callback_data=pack(MENU_DYNAMIC, ACTION_SELECT, option))]
+              for option in DYNAMIC_OPTIONS],
+            [InlineKeyboardButton(text="« Назад", callback_data=pack(MENU_DYNAMIC, ACTION_BACK))]
+        ]
+    ),
+}
 
 
 # Команда /help
@@ -33,16 +85,8 @@ async def cmd_help(message: types.Message):
 # Обработчик команды /start
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
-    # Создаём клавиатуру с двумя кнопками
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Привет"), KeyboardButton(text="Пока")]
-        ],
-        resize_keyboard=True,  # Подстраивает размер кнопок под экран
-        one_time_keyboard=False  # Кнопки остаются после нажатия
-    )
-
-    await message.answer("Выберите действие:", reply_markup=keyboard)
+    # Клавиатура с двумя кнопками берётся из реестра
+    await message.answer("Выберите действие:", reply_markup=KEYBOARDS["start"])
 
 
 # Обработчик текстовых сообщений (кнопок)
@@ -59,48 +103,37 @@ async def handle_greetings(message: types.Message):
 # ========== ЗАДАНИЕ 2: /links с URL-кнопками ==========
 @dp.message(Command("links"))
 async def cmd_links(message: types.Message):
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="📰 Новости", url="https://news.yandex.ru")],
-            [InlineKeyboardButton(text="🎵 Музыка", url="https://music.yandex.ru")],
-            [InlineKeyboardButton(text="🎬 Видео", url="https://youtube.com")]
-        ]
-    )
-    await message.answer("Нажмите на кнопку, чтобы перейти по ссылке:", reply_markup=keyboard)
+    await message.answer("Нажмите на кнопку, чтобы перейти по ссылке:", reply_markup=KEYBOARDS["links"])
 
 
 # ========== ЗАДАНИЕ 3: /dynamic — Динамическая клавиатура ==========
 @dp.message(Command("dynamic"))
 async def cmd_dynamic(message: types.Message):
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Показать больше опций", callback_data="show_more")]
-        ]
-    )
-    await message.answer("Нажмите кнопку ниже:", reply_markup=keyboard)
+    await message.answer("Нажмите кнопку ниже:", reply_markup=KEYBOARDS["dynamic"])
 
 # Обработчик: "Показать больше"
-@dp.callback_query(lambda c: c.data == "show_more")
-async def show_more_options(callback: types.CallbackQuery):
-    # Создаём новую клавиатуру
-    new_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Опция 1", callback_data="option_1")],
-            [InlineKeyboardButton(text="Опция 2", callback_data="option_2")]
-        ]
-    )
-
+@dp.callback_query(callback_filter(MENU_DYNAMIC, ACTION_SHOW_MORE))
+async def show_more_options(callback: types.CallbackQuery, payload: CallbackPayload):
     # Редактируем сообщение: меняем текст и клавиатуру
     await callback.message.edit_text(
         text="Выберите опцию:",
-        reply_markup=new_keyboard
+        reply_markup=KEYBOARDS["dynamic_options"]
     )
     await callback.answer()  # Скрываем "кружок загрузки"
 
-# Обработчики: "Опция 1" и "Опция 2"
-@dp.callback_query(lambda c: c.data in ["option_1", "option_2"])
-async def handle_option(callback: types.CallbackQuery):
-    option = callback.data.replace("option_", "")
+# Обработчик: "Назад" — возвращаем исходное сообщение
+@dp.callback_query(callback_filter(MENU_DYNAMIC, ACTION_BACK))
+async def show_less_options(callback: types.CallbackQuery, payload: CallbackPayload):
+    await callback.message.edit_text(
+        text="Нажмите кнопку ниже:",
+        reply_markup=KEYBOARDS["dynamic"]
+    )
+    await callback.answer()
+
+# Обработчики: "Опция 1" и "Опция 2" — номер опции приходит в самой кнопке
+@dp.callback_query(callback_filter(MENU_DYNAMIC, ACTION_SELECT))
+async def handle_option(callback: types.CallbackQuery, payload: CallbackPayload):
+    option = payload.args[0]
     await callback.message.answer(f"Вы выбрали: <b>Опция {option}</b>", parse_mode="HTML")
     await callback.answer()  # Скрываем "кружок загрузки"
 
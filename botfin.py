@@ -1,6 +1,8 @@
 import os
 import asyncio
+import math
 import random
+from datetime import datetime, timezone
 
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -19,6 +21,12 @@ import aiohttp
 import logging
 import requests
 
+import botfin_db
+import metrics
+import outbound
+import stall_profiler
+import throttling
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -28,7 +36,10 @@ logger = logging.getLogger(__name__)
 
 # Инициализируем бота и диспетчер
 bot = Bot(token=os.getenv("BOT_TOKEN"))
+outbound.install(bot)
 dp = Dispatcher()
+metrics.install(dp)
+stall_profiler.install(dp)
 
 # Формируем кнопки
 button_consent = KeyboardButton(text="Дать согласие на обработку персональных данных")
@@ -37,35 +48,42 @@ button_reg = KeyboardButton(text="Регистрация в телеграм б
 button_exchange_rates = KeyboardButton(text="Курс валют")
 button_tips = KeyboardButton(text="Советы по экономии")
 button_finances = KeyboardButton(text="Личные финансы")
+button_report = KeyboardButton(text="Отчёт о расходах")
 
 keyboards = ReplyKeyboardMarkup(keyboard=[
     [button_consent],
     [button_unconsent],
     [button_reg, button_exchange_rates],
-    [button_tips, button_finances]
+    [button_tips, button_finances],
+    [button_report]
     ], resize_keyboard=True)
 
+# Адрес API курсов валют (можно переопределить, например, для нагрузочного теста)
+EXCHANGE_RATES_URL = os.getenv(
+    "EXCHANGE_RATES_URL",
+    "https://v6.exchangerate-api.com/v6/09edf8b2bb246e1f801cbfba/latest/USD"
+)
+
+# Последний полученный курс: его отдаём, если пользователь упёрся в ограничение частоты
+last_rates = {}
+
+throttling.install(dp, {
+    "exchange_rates": throttling.Rule(rate=1 / 10, burst=3, upstream="exchange",
+                                      fallback=lambda message: last_rates.get("text")),
+}, upstream_limits={"exchange": 5})
+
 # Инициализация базы данных (асинхронно)
-DB_PATH = 'user.db'
+DB_PATH = botfin_db.DB_PATH
+
+def connect_db():
+    # Соединение с БД, время запросов к которой попадает в метрики
+    return metrics.TimedConnection(aiosqlite.connect(DB_PATH))
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                name TEXT,
-                consent_status TEXT DEFAULT 'N',  -- N = нет, Y = да
-                consent_date TEXT,
-                unconsent_date TEXT,
-                category1 TEXT,
-                category2 TEXT,
-                category3 TEXT,
-                expenses1 REAL,
-                expenses2 REAL,
-                expenses3 REAL
-            )
-        ''')
+    async with connect_db() as db:
+        # Схема описана в botfin_db.py: её же использует выгрузка/загрузка данных
+        for statement in botfin_db.SCHEMA:
+            await db.execute(statement)
         await db.commit()
         logger.info("База данных инициализирована.")
 
@@ -98,7 +116,7 @@ async def consent(message: Message):
     telegram_id = message.from_user.id
     name = message.from_user.full_name or "Пользователь без имени"
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect_db() as db:
         cursor = await db.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
         user = await cursor.fetchone()
 
@@ -127,7 +145,7 @@ async def consent(message: Message):
 async def unconsent(message: Message):
     telegram_id = message.from_user.id
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect_db() as db:
         cursor = await db.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
         user = await cursor.fetchone()
 
@@ -152,7 +170,7 @@ async def registration(message: Message):
     telegram_id = message.from_user.id
     name = message.from_user.full_name or "Неизвестный"
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect_db() as db:
         cursor = await db.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
         user = await cursor.fetchone()
 
@@ -174,9 +192,9 @@ async def registration(message: Message):
 # Обработчик кнопки курса валют
 @dp.message(F.text == "Курс валют")
 async def exchange_rates(message: Message):
-    url = "https://v6.exchangerate-api.com/v6/09edf8b2bb246e1f801cbfba/latest/USD"
     try:
-        response = requests.get(url)
+        with metrics.upstream("exchange"):
+            response = requests.get(EXCHANGE_RATES_URL)
         data = response.json()
         if response.status_code != 200:
             await message.answer("Не удалось получить данные о курсе валют!")
@@ -186,8 +204,9 @@ async def exchange_rates(message: Message):
 
         euro_to_rub = eur_to_usd * usd_to_rub
 
-        await message.answer(f"1 USD - {usd_to_rub:.2f}  RUB\n"
-                             f"1 EUR - {euro_to_rub:.2f}  RUB")
+        last_rates["text"] = (f"1 USD - {usd_to_rub:.2f}  RUB\n"
+                              f"1 EUR - {euro_to_rub:.2f}  RUB")
+        await message.answer(last_rates["text"])
 
 
     except:
@@ -213,7 +232,7 @@ async def finances(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
 
     # Сперва проверим, дал ли пользователь согласие на обработку персональных данных
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect_db() as db:
         cursor = await db.execute('SELECT consent_status FROM users WHERE telegram_id = ?', (telegram_id,))
         user = await cursor.fetchone()
 
@@ -228,7 +247,10 @@ async def finances(message: Message, state: FSMContext):
 # Шаг 1: Ввод категории 1
 @dp.message(FinancesForm.category1)
 async def process_category1(message: Message, state: FSMContext):
-    await state.update_data(category1=message.text)
+    if not (message.text or "").strip():
+        await message.answer("❌ Введите название категории текстом (например, 'Еда')")
+        return
+    await state.update_data(category1=message.text.strip())
     await state.set_state(FinancesForm.expenses1)
     await message.answer("Введите сумму по этой категории (в рублях):")
 
@@ -237,7 +259,10 @@ async def process_category1(message: Message, state: FSMContext):
 async def process_expenses1(message: Message, state: FSMContext):
     try:
         expenses = float(message.text)
-    except ValueError:
+        # float() принимает и nan, inf, 1e999 - такие суммы, как и отрицательные, не сохраняем
+        if not math.isfinite(expenses) or expenses < 0:
+            raise ValueError(message.text)
+    except (TypeError, ValueError):  # TypeError - прислали не текст (стикер, фото)
         await message.answer("❌ Введите число (например, 500.0)")
         return
 
@@ -248,7 +273,10 @@ async def process_expenses1(message: Message, state: FSMContext):
 # Шаг 3: Ввод категории 2
 @dp.message(FinancesForm.category2)
 async def process_category2(message: Message, state: FSMContext):
-    await state.update_data(category2=message.text)
+    if not (message.text or "").strip():
+        await message.answer("❌ Введите название категории текстом (например, 'Еда')")
+        return
+    await state.update_data(category2=message.text.strip())
     await state.set_state(FinancesForm.expenses2)
     await message.answer("Введите сумму по этой категории (в рублях):")
 
@@ -257,7 +285,10 @@ async def process_category2(message: Message, state: FSMContext):
 async def process_expenses2(message: Message, state: FSMContext):
     try:
         expenses = float(message.text)
-    except ValueError:
+        # float() принимает и nan, inf, 1e999 - такие суммы, как и отрицательные, не сохраняем
+        if not math.isfinite(expenses) or expenses < 0:
+            raise ValueError(message.text)
+    except (TypeError, ValueError):  # TypeError - прислали не текст (стикер, фото)
         await message.answer("❌ Введите число (например, 500.0)")
         return
 
@@ -268,7 +299,10 @@ async def process_expenses2(message: Message, state: FSMContext):
 # Шаг 5: Ввод категории 3
 @dp.message(FinancesForm.category3)
 async def process_category3(message: Message, state: FSMContext):
-    await state.update_data(category3=message.text)
+    if not (message.text or "").strip():
+        await message.answer("❌ Введите название категории текстом (например, 'Еда')")
+        return
+    await state.update_data(category3=message.text.strip())
     await state.set_state(FinancesForm.expenses3)
     await message.answer("Введите сумму по этой категории (в рублях):")
 
@@ -277,7 +311,10 @@ async def process_category3(message: Message, state: FSMContext):
 async def process_expenses3(message: Message, state: FSMContext):
     try:
         expenses = float(message.text)
-    except ValueError:
+        # float() принимает и nan, inf, 1e999 - такие суммы, как и отрицательные, не сохраняем
+        if not math.isfinite(expenses) or expenses < 0:
+            raise ValueError(message.text)
+    except (TypeError, ValueError):  # TypeError - прислали не текст (стикер, фото)
         await message.answer("❌ Введите число (например, 500.0)")
         return
 
@@ -291,9 +328,11 @@ async def process_expenses3(message: Message, state: FSMContext):
     category3 = data.get("category3")
     expenses3 = expenses  # Только что введённая сумма
     telegram_id = message.from_user.id
+    created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    items = [(category1, expenses1), (category2, expenses2), (category3, expenses3)]
 
     # ✅ АСИНХРОННОЕ ОБНОВЛЕНИЕ В БАЗЕ ДАННЫХ
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect_db() as db:
         await db.execute('''
             UPDATE users 
             SET category1 = ?, expenses1 = ?, 
@@ -306,6 +345,9 @@ async def process_expenses3(message: Message, state: FSMContext):
             category3, expenses3,
             telegram_id
         ))
+        # История расходов и сводные таблицы - в той же транзакции
+        for sql, rows in botfin_db.expense_writes(telegram_id, items, created_at):
+            await db.executemany(sql, rows)
         await db.commit()  # ✅ Обязательно! Без этого изменения не сохранятся!
 
     await state.clear()
@@ -317,6 +359,37 @@ async def process_expenses3(message: Message, state: FSMContext):
     )
 
 
+# Отчёт о расходах: итоги берутся из сводных таблиц по ключу, без пересчёта всех расходов
+@dp.message(F.text == "Отчёт о расходах")
+async def expenses_report(message: Message):
+    telegram_id = message.from_user.id
+    month = datetime.now(timezone.utc).strftime("%Y-%m")
+
+    async with connect_db() as db:
+        cursor = await db.execute('SELECT total, count FROM user_totals WHERE telegram_id = ?', (telegram_id,))
+        overall = await cursor.fetchone()
+        if not overall:
+            await message.answer("📭 Расходов пока нет. Нажмите «Личные финансы», чтобы их внести.")
+            return
+
+        cursor = await db.execute('SELECT total, count FROM month_totals WHERE telegram_id = ? AND month = ?',
+                                  (telegram_id, month))
+        this_month = await cursor.fetchone() or (0.0, 0)
+        cursor = await db.execute(
+            'SELECT category, total FROM category_totals WHERE telegram_id = ? AND month = ? ORDER BY total DESC',
+            (telegram_id, month)
+        )
+        categories = await cursor.fetchall()
+
+    lines = [
+        "📊 Ваши расходы\n",
+        f"За всё время: {overall[0]:.2f} ₽, записей: {overall[1]}",
+        f"В этом месяце: {this_month[0]:.2f} ₽, записей: {this_month[1]}",
+    ]
+    lines += [f"• {category}: {total:.2f} ₽" for category, total in categories]
+    await message.answer("\n".join(lines))
+
+
 # --- Запуск ---
 async def main():
     await init_db()  # Инициализация БД перед запуском бота
@@ -0,0 +1,423 @@
+"""
+Схема базы botfin.py (user.db), сводные таблицы расходов и потоковая
+выгрузка/загрузка данных.
+
+    python botfin_db.py export users.csv
+    python botfin_db.py export expenses.parquet --table expenses --db /data/user.db --batch 50000
+    python botfin_db.py import users.jsonl
+    python botfin_db.py check
+    python botfin_db.py rebuild
+
+Формат определяется по расширению файла (csv, jsonl, parquet) или задаётся
+--format. Выгрузка читает таблицу курсором пачками по --batch строк (fetchmany)
+и сразу пишет каждую пачку в файл, поэтому память не растёт с размером таблицы.
+В выгрузку попадают все столбцы, в том числе периоды согласия
+(consent_date/unconsent_date).
+
+Загрузка читает файл такими же пачками и пишет их через executemany, фиксируя
+транзакцию раз в COMMIT_ROWS строк. Столбец id из файла не загружается: строки
+получают новые id. Пользователь с уже существующим telegram_id обновляется,
+а расходы загружаются только в пустую таблицу expenses (иначе повторная
+загрузка задвоила бы их). Для Parquet нужен pyarrow.
+
+В CSV нет NULL, поэтому NULL записывается как \\N, а пустая строка остаётся
+пустой; значения, которые начинаются с обратной косой черты, экранируются
+ещё одной.
+
+Каждый введённый расход сохраняется строкой в expenses, а в той же транзакции
+обновляются сводные таблицы (AGGREGATES): итоги пользователя, итоги за месяц
+и итоги по категориям за месяц. Отчёт читает готовые итоги по первичному ключу
+и не пересчитывает расходы. check сверяет сводные таблицы с тем, что получается
+из expenses заново, rebuild пересчитывает их целиком (после загрузки expenses
+это делается автоматически).
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+import sqlite3
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'user.db'
+
+USERS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER UNIQUE,
+        name TEXT,
+        consent_status TEXT DEFAULT 'N',  -- N = нет, Y = да
+        consent_date TEXT,
+        unconsent_date TEXT,
+        category1 TEXT,
+        category2 TEXT,
+        category3 TEXT,
+        expenses1 REAL,
+        expenses2 REAL,
+        expenses3 REAL
+    )
+'''
+
+EXPENSES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        amount REAL NOT NULL,
+        created_at TEXT NOT NULL  -- ГГГГ-ММ-ДД ЧЧ:ММ:СС по UTC
+    )
+'''
+
+# Сводные таблицы: имя -> ключ (столбец -> выражение над expenses).
+# В каждой, кроме ключа, хранятся сумма (total) и число расходов (count).
+AGGREGATES = {
+    "user_totals": {"telegram_id": "telegram_id"},
+    "month_totals": {"telegram_id": "telegram_id", "month": "substr(created_at, 1, 7)"},
+    "category_totals": {"telegram_id": "telegram_id", "month": "substr(created_at, 1, 7)", "category": "category"},
+}
+
+# Расхождение сумм меньше этого считаем ошибкой округления, а не рассинхронизацией
+TOTAL_TOLERANCE = 1e-6
+
+
+def _aggregate_schema(table: str, key: dict) -> str:
+    columns = "".join(f"{name} {'INTEGER' if name == 'telegram_id' else 'TEXT'} NOT NULL, " for name in key)
+    return (f'CREATE TABLE IF NOT EXISTS {table} ({columns}total REAL NOT NULL, count INTEGER NOT NULL, '
+            f'PRIMARY KEY ({", ".join(key)})) WITHOUT ROWID')
+
+
+def _aggregate_upsert(table: str, key: dict) -> str:
+    return (f'INSERT INTO {table} ({", ".join(key)}, total, count) VALUES ({"?, " * len(key)}?, 1) '
+            f'ON CONFLICT ({", ".join(key)}) DO UPDATE SET total = total + excluded.total, count = count + 1')
+
+
+# Все таблицы базы в порядке создания
+SCHEMA = [USERS_SCHEMA, EXPENSES_SCHEMA] + [_aggregate_schema(table, key) for table, key in AGGREGATES.items()]
+
+INSERT_EXPENSE = 'INSERT INTO expenses (telegram_id, category, amount, created_at) VALUES (?, ?, ?, ?)'
+AGGREGATE_UPSERTS = {table: _aggregate_upsert(table, key) for table, key in AGGREGATES.items()}
+
+# Таблицы, которые можно выгружать и загружать: имя -> схема
+TABLES = {
+    "users": USERS_SCHEMA,
+    "expenses": EXPENSES_SCHEMA,
+}
+
+# Уникальный ключ, по которому загрузка обновляет существующие строки
+# (None - таблица загружается только в пустую)
+IMPORT_KEYS = {
+    "users": "telegram_id",
+    "expenses": None,
+}
+
+CSV_NULL = "\\N"
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+BATCH_SIZE = 10_000  # строк в одной пачке при чтении и записи
+COMMIT_ROWS = 500_000  # строк в одной транзакции при загрузке
+
+
+def detect_format(path: str, fmt: str = None) -> str:
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise SystemExit(f"Неизвестный формат {fmt!r}, поддерживаются: {', '.join(FORMATS)}")
+    return fmt
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Для формата Parquet установите pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def expense_writes(telegram_id: int, items: list, created_at: str) -> list:
+    """
+    Запросы для сохранения расходов items [(категория, сумма)]: строки expenses
+    и приращения сводных таблиц. Возвращает [(sql, строки для executemany)],
+    выполнять их нужно в одной транзакции.
+    """
+    for category, amount in items:
+        # NaN SQLite сохранил бы как NULL, а inf навсегда испортил бы итоги
+        if not math.isfinite(amount):
+            raise ValueError(f"Некорректная сумма {amount!r} в категории {category!r}")
+    rows = {"telegram_id": telegram_id, "month": created_at[:7]}
+    writes = [(INSERT_EXPENSE, [(telegram_id, category, amount, created_at) for category, amount in items])]
+    for table, key in AGGREGATES.items():
+        writes.append((AGGREGATE_UPSERTS[table], [
+            tuple(category if name == "category" else rows[name] for name in key) + (amount,)
+            for category, amount in items
+        ]))
+    return writes
+
+
+def _aggregate_select(key: dict) -> str:
+    columns = ", ".join(f"{expression} AS {name}" for name, expression in key.items())
+    return f'SELECT {columns}, SUM(amount) AS total, COUNT(*) AS count FROM expenses GROUP BY {", ".join(key)}'
+
+
+def rebuild_aggregates(db: sqlite3.Connection):
+    """Пересчитывает все сводные таблицы из expenses одной транзакцией"""
+    db.execute('BEGIN')
+    for table, key in AGGREGATES.items():
+        db.execute(f'DELETE FROM {table}')
+        db.execute(f'INSERT INTO {table} ({", ".join(key)}, total, count) {_aggregate_select(key)}')
+    db.execute('COMMIT')
+
+
+def check_aggregates(db: sqlite3.Connection) -> dict:
+    """Число расходящихся строк в каждой сводной таблице по сравнению с пересчётом из expenses"""
+    mismatches = {}
+    for table, key in AGGREGATES.items():
+        join = " AND ".join(f"a.{name} = e.{name}" for name in key)
+        differs = f"a.count <> e.count OR abs(a.total - e.total) > {TOTAL_TOLERANCE} * max(1, abs(e.total))"
+        expected = _aggregate_select(key)
+        missing_or_wrong, = db.execute(
+            f'SELECT COUNT(*) FROM ({expected}) e LEFT JOIN {table} a ON {join} '
+            f'WHERE a.count IS NULL OR {differs}'
+        ).fetchone()
+        extra, = db.execute(
+            f'SELECT COUNT(*) FROM {table} a LEFT JOIN ({expected}) e ON {join} WHERE e.count IS NULL'
+        ).fetchone()
+        mismatches[table] = missing_or_wrong + extra
+    return mismatches
+
+
+def create_schema(db: sqlite3.Connection):
+    for statement in SCHEMA:
+        db.execute(statement)
+
+
+def column_types(db: sqlite3.Connection, table: str) -> dict:
+    """Столбцы таблицы и их объявленные типы"""
+    return {name: decl.upper() for _, name, decl, *_ in db.execute(f'PRAGMA table_info({table})')}
+
+
+# --- Выгрузка ---
+
+def export_table(db: sqlite3.Connection, table: str, path: str, fmt: str, batch_size: int = BATCH_SIZE) -> int:
+    types = column_types(db, table)
+    if not types:
+        raise SystemExit(f"В базе нет таблицы {table}")
+    cursor = db.execute(f'SELECT {", ".join(types)} FROM {table} ORDER BY rowid')
+    columns = [d[0] for d in cursor.description]
+    batches = iter(lambda: cursor.fetchmany(batch_size), [])
+
+    writer = {"csv": _write_csv, "jsonl": _write_jsonl, "parquet": _write_parquet}[fmt]
+    return writer(path, columns, types, batches)
+
+
+def _write_csv(path, columns, types, batches) -> int:
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows([_csv_value(value) for value in row] for row in batch)
+            rows += len(batch)
+    return rows
+
+
+def _csv_value(value):
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, str) and value.startswith("\\"):
+        return "\\" + value
+    return value
+
+
+def _write_jsonl(path, columns, types, batches) -> int:
+    rows = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for batch in batches:
+            f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch)
+            rows += len(batch)
+    return rows
+
+
+def _write_parquet(path, columns, types, batches) -> int:
+    pa = require_pyarrow()
+    arrow_types = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    schema = pa.schema([(name, arrow_types.get(types[name], pa.string())) for name in columns])
+
+    rows = 0
+    with pa.parquet.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            # Пачка строк -> столбцы
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            rows += len(batch)
+    return rows
+
+
+# --- Загрузка ---
+
+def import_table(db: sqlite3.Connection, table: str, path: str, fmt: str, batch_size: int = BATCH_SIZE,
+                 commit_rows: int = COMMIT_ROWS) -> int:
+    create_schema(db)
+    types = column_types(db, table)
+
+    reader = {"csv": _read_csv, "jsonl": _read_jsonl, "parquet": _read_parquet}[fmt]
+    columns, batches = reader(path, batch_size)
+    unknown = [name for name in columns if name not in types]
+    if unknown:
+        raise SystemExit(f"В таблице {table} нет столбцов: {', '.join(unknown)}")
+
+    # id из файла не загружаем: он мог бы совпасть с id другой строки в базе
+    keep = [i for i, name in enumerate(columns) if name != "id"]
+    columns = [columns[i] for i in keep]
+
+    key = IMPORT_KEYS[table]
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    if key is None:
+        if db.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+            raise SystemExit(f"Таблица {table} не пуста: загружать её можно только в пустую таблицу")
+    elif key not in columns:
+        raise SystemExit(f"В файле нет столбца {key}")
+    else:
+        updates = ", ".join(f"{name} = excluded.{name}" for name in columns if name != key)
+        sql += f' ON CONFLICT ({key}) DO ' + (f'UPDATE SET {updates}' if updates else 'NOTHING')
+
+    rows = uncommitted = 0
+    db.execute('BEGIN')
+    for batch in batches:
+        if len(keep) < len(batch[0]):
+            batch = [[row[i] for i in keep] for row in batch]
+        db.executemany(sql, batch)
+        rows += len(batch)
+        uncommitted += len(batch)
+        if uncommitted >= commit_rows:
+            db.execute('COMMIT')
+            db.execute('BEGIN')
+            uncommitted = 0
+    db.execute('COMMIT')
+
+    if table == "expenses":
+        rebuild_aggregates(db)
+    return rows
+
+
+def _batched(rows, batch_size: int):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        yield batch
+
+
+def _read_csv(path, batch_size):
+    f = open(path, encoding="utf-8", newline="")
+    reader = csv.reader(f)
+    columns = next(reader, [])
+
+    def batches():
+        with f:
+            yield from _batched(([_csv_parse(value) for value in row] for row in reader), batch_size)
+
+    return columns, batches()
+
+
+def _csv_parse(value: str):
+    if value == CSV_NULL:
+        return None
+    if value.startswith("\\\\"):
+        return value[1:]
+    return value
+
+
+def _read_jsonl(path, batch_size):
+    f = open(path, encoding="utf-8")
+    lines = (line for line in f if line.strip())
+    first = next(lines, None)
+    columns = list(json.loads(first)) if first else []
+
+    def batches():
+        with f:
+            records = itertools.chain([first] if first else [], lines)
+            yield from _batched(([record.get(name) for name in columns] for record in map(json.loads, records)),
+                                batch_size)
+
+    return columns, batches()
+
+
+def _read_parquet(path, batch_size):
+    pa = require_pyarrow()
+    parquet_file = pa.parquet.ParquetFile(path)
+    columns = parquet_file.schema_arrow.names
+
+    def batches():
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield list(zip(*(column.to_pylist() for column in record_batch.columns)))
+
+    return columns, batches()
+
+
+# --- Командная строка ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка данных botfin.py, сверка сводных таблиц")
+    parser.add_argument("command", choices=("export", "import", "check", "rebuild"))
+    parser.add_argument("path", nargs="?", help="файл выгрузки (для export и import)")
+    parser.add_argument("--db", default=DB_PATH, help=f"база данных (по умолчанию {DB_PATH})")
+    parser.add_argument("--table", default="users", choices=sorted(TABLES))
+    parser.add_argument("--format", choices=FORMATS, help="по умолчанию - по расширению файла")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="строк в пачке")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command in ("check", "rebuild"):
+        return aggregates_command(args.command, args.db)
+    if not args.path:
+        parser.error(f"для {args.command} нужен файл выгрузки")
+
+    fmt = detect_format(args.path, args.format)
+    if fmt == "parquet":
+        require_pyarrow()
+
+    # isolation_level=None: транзакциями при загрузке управляем сами
+    db = sqlite3.connect(args.db, isolation_level=None)
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            rows = export_table(db, args.table, args.path, fmt, args.batch)
+        else:
+            rows = import_table(db, args.table, args.path, fmt, args.batch)
+    finally:
+        db.close()
+
+    logger.info("%s %s: %d строк за %.1f с", "Выгружено из" if args.command == "export" else "Загружено в",
+                args.table, rows, time.perf_counter() - started)
+    return 0
+
+
+def aggregates_command(command: str, path: str) -> int:
+    db = sqlite3.connect(path, isolation_level=None)
+    started = time.perf_counter()
+    try:
+        create_schema(db)
+        if command == "rebuild":
+            rebuild_aggregates(db)
+            logger.info("Сводные таблицы пересчитаны за %.1f с", time.perf_counter() - started)
+            return 0
+        mismatches = check_aggregates(db)
+    finally:
+        db.close()
+
+    for table, count in mismatches.items():
+        if count:
+            logger.warning("%s: расходятся %d строк", table, count)
+    if any(mismatches.values()):
+        logger.warning("Сводные таблицы не совпадают с expenses, пересчитайте их: python botfin_db.py rebuild")
+        return 1
+    logger.info("Сводные таблицы совпадают с expenses (%.1f с)", time.perf_counter() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
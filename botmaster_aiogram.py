@@ -7,6 +7,11 @@ from aiogram.filters import Command
 from aiogram.utils.markdown import hbold, hitalic
 from dotenv import load_dotenv
 
+import metrics
+import outbound
+import stall_profiler
+import throttling
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -16,13 +21,33 @@ logger = logging.getLogger(__name__)
 
 # Инициализируем бота и диспетчер
 bot = Bot(token=os.getenv("BOT_TOKEN"))
+outbound.install(bot)
 dp = Dispatcher()
+metrics.install(dp)
+stall_profiler.install(dp)
+
+# Адреса сторонних API (можно переопределить, например, для нагрузочного теста)
+JOKE_API_URL = os.getenv("JOKE_API_URL", "https://v2.jokeapi.dev/joke/Any?safe-mode")
+BORED_API_URL = os.getenv("BORED_API_URL", "https://apis.scrimba.com/bored/api/activity")
+FACTS_API_URL = os.getenv("FACTS_API_URL", "https://uselessfacts.jsph.pl/random.json?language=ru")
+CAT_API_URL = os.getenv("CAT_API_URL", "https://api.thecatapi.com/v1/images/search")
+POKEMON_API_URL = os.getenv("POKEMON_API_URL", "https://pokeapi.co/api/v2/pokemon")
+
+# Ограничение частоты запросов к сторонним API: каждая команда - один запрос
+throttling.install(dp, {
+    "cmd_fact": throttling.Rule(rate=1 / 5, burst=3, upstream="facts"),
+    "cmd_bored": throttling.Rule(rate=1 / 5, burst=3, upstream="bored"),
+    "cmd_cat": throttling.Rule(rate=1 / 5, burst=3, upstream="cat"),
+    "cmd_joke": throttling.Rule(rate=1 / 5, burst=3, upstream="joke"),
+    "cmd_pokemon": throttling.Rule(rate=1 / 5, burst=3, upstream="pokemon"),
+}, upstream_limits={"facts": 5, "bored": 5, "cat": 5, "joke": 5, "pokemon": 5})
 
 
 def get_joke():
     """Шутка — замена icanhazdadjoke.com"""
     try:
-        response = requests.get("https://v2.jokeapi.dev/joke/Any?safe-mode")
+        with metrics.upstream("joke"):
+            response = requests.get(JOKE_API_URL)
         data = response.json()
         if data["type"] == "single":
             return data["joke"]
@@ -35,7 +60,8 @@ def get_joke():
 def get_bored_activity():
     """Занятие — замена boredapi.com"""
     try:
-        response = requests.get("https://apis.scrimba.com/bored/api/activity")
+        with metrics.upstream("bored"):
+            response = requests.get(BORED_API_URL)
         data = response.json()
 
         # Словарь перевода типов активностей
@@ -67,7 +93,8 @@ def get_bored_activity():
 def get_number_fact():
     """Факт о числе — замена numbersapi.com"""
     try:
-        response = requests.get("https://uselessfacts.jsph.pl/random.json?language=ru")
+        with metrics.upstream("facts"):
+            response = requests.get(FACTS_API_URL)
         data = response.json()
         return data["text"]  # Текст факта на русском
     except Exception as e:
@@ -76,7 +103,8 @@ def get_number_fact():
 def get_cat_image():
     """Котик — замена random.cat"""
     try:
-        response = requests.get("https://api.thecatapi.com/v1/images/search")
+        with metrics.upstream("cat"):
+            response = requests.get(CAT_API_URL)
         data = response.json()
         return data[0]["url"]
     except Exception as e:
@@ -86,8 +114,9 @@ def get_cat_image():
 def get_pokemon_info(pokemon_name):
     """Покемон — уже работает"""
     try:
-        url = f"https://pokeapi.co/api/v2/pokemon/{pokemon_name.lower()}"
-        response = requests.get(url)
+        url = f"{POKEMON_API_URL}/{pokemon_name.lower()}"
+        with metrics.upstream("pokemon"):
+            response = requests.get(url)
         if response.status_code != 200:
             return f"❌ Покемон '{pokemon_name}' не найден. Попробуй другое имя."
 
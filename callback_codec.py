@@ -0,0 +1,82 @@
+"""
+Компактный кодек callback_data для inline-кнопок.
+
+Telegram ограничивает callback_data 64 байтами, поэтому вместо строк вида
+"option_1" состояние кнопки упаковывается в двоичный вид:
+
+    версия схемы (1 байт) | меню (1 байт) | действие (1 байт) | аргументы (по 2 байта)
+
+и кодируется в base64url без паддинга. Аргументы - беззнаковые числа 0..65535
+(номер опции, страница списка, уровень меню и т.п.), так что обработчику
+не нужно ничего хранить на сервере и разбирать строки.
+"""
+import base64
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+# Версия схемы: увеличиваем при несовместимом изменении формата,
+# старые кнопки в истории чата тогда просто перестают распознаваться
+SCHEMA_VERSION = 1
+
+# Ограничение Telegram на длину callback_data
+MAX_CALLBACK_BYTES = 64
+
+_HEADER = struct.Struct(">BBB")  # версия, меню, действие
+_ARG_SIZE = struct.calcsize(">H")
+
+# Сколько аргументов помещается в 64 символа base64 (48 исходных байт)
+MAX_ARGS = (MAX_CALLBACK_BYTES * 3 // 4 - _HEADER.size) // _ARG_SIZE
+
+
+class CallbackPayload(NamedTuple):
+    menu: int
+    action: int
+    args: Tuple[int, ...] = ()
+
+
+def pack(menu: int, action: int, *args: int) -> str:
+    """Упаковывает меню, действие и числовые аргументы в строку callback_data"""
+    if len(args) > MAX_ARGS:
+        raise ValueError(f"Слишком много аргументов: {len(args)} > {MAX_ARGS}")
+
+    raw = _HEADER.pack(SCHEMA_VERSION, menu, action) + struct.pack(f">{len(args)}H", *args)
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def unpack(data: Optional[str]) -> Optional[CallbackPayload]:
+    """Распаковывает callback_data; для чужих и устаревших данных возвращает None"""
+    if not data or len(data) > MAX_CALLBACK_BYTES:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except ValueError:
+        return None
+
+    if len(raw) < _HEADER.size or (len(raw) - _HEADER.size) % _ARG_SIZE:
+        return None
+
+    version, menu, action = _HEADER.unpack_from(raw)
+    if version != SCHEMA_VERSION:
+        return None
+
+    count = (len(raw) - _HEADER.size) // _ARG_SIZE
+    args = struct.unpack_from(f">{count}H", raw, _HEADER.size)
+    return CallbackPayload(menu, action, args)
+
+
+def callback_filter(menu: int, *actions: int):
+    """
+    Фильтр для dp.callback_query: пропускает кнопки указанного меню
+    (и, если заданы, только указанных действий) и передаёт в обработчик
+    уже распакованный аргумент payload.
+    """
+    def check(callback) -> object:
+        payload = unpack(callback.data)
+        if payload is None or payload.menu != menu:
+            return False
+        if actions and payload.action not in actions:
+            return False
+        return {"payload": payload}
+
+    return check
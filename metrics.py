@@ -0,0 +1,245 @@
+"""
+Метрики ботов в формате Prometheus.
+
+- MetricsMiddleware считает время и ошибки каждого обработчика;
+- upstream("weather") - контекстный менеджер вокруг HTTP-запроса или обращения
+  к БД, считает время и ошибки по каждому upstream;
+- cache_hit/cache_miss - попадания в кэши;
+- фоновая задача меряет лаг цикла событий.
+
+Счётчики - обычные числа в словарях: все обработчики выполняются в одном потоке
+цикла событий, поэтому блокировки не нужны. Если задан METRICS_PORT, метрики
+отдаются на http://<хост>:<METRICS_PORT>/metrics.
+
+Отладочный вывод идёт через log_sampled: в лог попадает только доля событий
+(LOG_SAMPLE_RATE, по умолчанию 1%), а не каждое.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE") or 0.01)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    __slots__ = ("name", "description", "labels", "values")
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    __slots__ = ()
+    kind = "gauge"
+
+    def set(self, *label_values, value: float):
+        self.values[label_values] = value
+
+
+class Histogram:
+    __slots__ = ("name", "description", "labels", "buckets", "series")
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # label_values -> [счётчики по корзинам..., +Inf, сумма]
+        self.series = {}
+
+    def observe(self, *label_values, value: float):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                labels = _labels((*self.labels, "le"), (*label_values, bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = (f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Необработанные исключения в обработчике", ("handler",))
+UPSTREAM_LATENCY = Histogram("bot_upstream_seconds", "Время обращения к upstream (API, БД)", ("upstream",))
+UPSTREAM_ERRORS = Counter("bot_upstream_errors_total", "Ошибки обращения к upstream", ("upstream",))
+CACHE_REQUESTS = Counter("bot_cache_requests_total", "Обращения к кэшу", ("cache", "result"))
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "Опоздание цикла событий", buckets=LAG_BUCKETS)
+LOOP_LAG_MAX = Gauge("bot_event_loop_lag_max_seconds", "Наибольший лаг цикла событий с запуска")
+
+REGISTRY = [HANDLER_LATENCY, HANDLER_ERRORS, UPSTREAM_LATENCY, UPSTREAM_ERRORS,
+            CACHE_REQUESTS, LOOP_LAG, LOOP_LAG_MAX]
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: меряет время каждого обработчика по его имени"""
+
+    async def __call__(self, handler, event, data):
+        name = handler_name(data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(name, value=time.perf_counter() - started)
+
+
+def handler_name(data: dict) -> str:
+    handler = data.get("handler")
+    return getattr(getattr(handler, "callback", None), "__name__", "unknown")
+
+
+@contextmanager
+def upstream(name: str):
+    """Меряет обращение к upstream: with metrics.upstream("weather"): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(name)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(name, value=time.perf_counter() - started)
+
+
+class TimedConnection:
+    """
+    Обёртка над соединением aiosqlite: время execute/commit попадает
+    в метрики upstream, остальное проксируется как есть.
+    """
+
+    def __init__(self, connection, name: str = "sqlite"):
+        self._connection = connection
+        self._name = name
+
+    async def __aenter__(self):
+        await self._connection.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self._connection.__aexit__(*exc_info)
+
+    async def execute(self, *args, **kwargs):
+        with upstream(self._name):
+            return await self._connection.execute(*args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        with upstream(self._name):
+            return await self._connection.executemany(*args, **kwargs)
+
+    async def commit(self):
+        with upstream(self._name):
+            return await self._connection.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.inc(cache, "hit")
+
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.inc(cache, "miss")
+
+
+def log_sampled(log: logging.Logger, event: str, rate: float = None, **fields):
+    """Пишет структурированное событие в лог с вероятностью rate"""
+    if random.random() < (LOG_SAMPLE_RATE if rate is None else rate):
+        log.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+async def _probe_loop_lag(interval: float = 0.1):
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.observe(value=lag)
+        if lag > worst:
+            worst = lag
+            LOOP_LAG_MAX.set(value=worst)
+
+
+async def _serve_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def install(dp: Dispatcher):
+    """Подключает метрики к диспетчеру бота"""
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+
+    tasks = []
+
+    async def on_startup(**kwargs):
+        tasks.append(asyncio.create_task(_probe_loop_lag()))
+        if METRICS_PORT:
+            app = web.Application()
+            app.router.add_get("/metrics", _serve_metrics)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, port=METRICS_PORT).start()
+            tasks.append(runner)
+            logger.info("Метрики доступны на порту %s (/metrics)", METRICS_PORT)
+
+    async def on_shutdown(**kwargs):
+        for task in tasks:
+            if isinstance(task, web.AppRunner):
+                await task.cleanup()
+            else:
+                task.cancel()
+        tasks.clear()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
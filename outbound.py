@@ -0,0 +1,294 @@
+"""
+Общая очередь исходящих сообщений с учётом лимитов Telegram.
+
+OutboundScheduler - request middleware сессии бота: все вызовы send*/edit*/
+copy*/forward* с chat_id не уходят в Telegram сразу, а встают в очередь,
+которую разбирает одна фоновая задача:
+
+- общий лимит около 30 сообщений в секунду (GLOBAL_RATE);
+- token bucket на каждый чат (около 1 сообщения в секунду с небольшим запасом);
+- ответы пользователям (interactive) идут раньше рассылок (bulk, см. bulk());
+- на 429 отправка приостанавливается на retry_after и сообщение повторяется;
+- несколько текстовых сообщений подряд в один чат, накопившиеся в очереди,
+  склеиваются в одно.
+
+Обработчикам ничего менять не нужно: message.answer() просто дожидается,
+пока его сообщение будет отправлено.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE") or 30)  # сообщений в секунду на бота
+CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE") or 1)  # сообщений в секунду в один чат
+CHAT_BURST = 3
+CHAT_IDLE_TTL = 60  # состояние чата без сообщений в очереди храним столько секунд
+MAX_RETRIES = 3
+MAX_MESSAGE_LENGTH = 4096  # лимит Telegram на длину текста, в кодовых единицах UTF-16
+MERGE_SEPARATOR = "\n\n"
+
+INTERACTIVE, BULK = 0, 1
+
+_QUEUED_PREFIXES = ("send", "edit", "copy", "forward")
+
+_priority = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+QUEUE_DEPTH = metrics.Gauge("bot_outbound_queue_depth", "Сообщения в очереди на отправку")
+RETRY_AFTER = metrics.Counter("bot_outbound_retry_after_total", "Ответы 429 от Telegram")
+MERGED = metrics.Counter("bot_outbound_merged_total", "Сообщения, склеенные с предыдущими")
+metrics.REGISTRY.extend([QUEUE_DEPTH, RETRY_AFTER, MERGED])
+
+
+@contextmanager
+def bulk():
+    """Сообщения, отправленные внутри блока, уступают очередь ответам пользователям"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Job:
+    __slots__ = ("make_request", "bot", "method", "priority", "future", "retries")
+
+    def __init__(self, make_request, bot, method, priority, future):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.priority = priority
+        self.future = future
+        self.retries = 0
+
+
+class _Chat:
+    __slots__ = ("jobs", "tokens", "updated", "scheduled")
+
+    def __init__(self, now: float):
+        self.jobs = deque()
+        self.tokens = CHAT_BURST
+        self.updated = now
+        self.scheduled = False
+
+    def ready_at(self, now: float) -> float:
+        """Когда в чат можно будет отправить следующее сообщение"""
+        self.tokens = min(CHAT_BURST, self.tokens + (now - self.updated) * CHAT_RATE)
+        self.updated = now
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / CHAT_RATE
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = GLOBAL_RATE):
+        self.global_rate = global_rate
+        self._tokens = global_rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+        self._chats = {}  # chat_id -> _Chat
+        self._ready = (deque(), deque())  # очереди чатов по приоритету
+        self._delayed = []  # куча (когда, номер, chat_id) - чаты, упёршиеся в свой лимит
+        self._delayed_seq = itertools.count()
+        self._depth = 0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._in_flight = set()
+        self._last_sweep = time.monotonic()
+
+    async def __call__(self, make_request, bot: Bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(_QUEUED_PREFIXES):
+            return await make_request(bot, method)
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, _Job(make_request, bot, method, _priority.get(), future))
+        return await future
+
+    # --- Очередь ---
+
+    def _enqueue(self, chat_id, job: _Job, front: bool = False):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(time.monotonic())
+        if front:
+            chat.jobs.appendleft(job)
+        else:
+            chat.jobs.append(job)
+        self._depth += 1
+        QUEUE_DEPTH.set(value=self._depth)
+
+        if not chat.scheduled:
+            chat.scheduled = True
+            self._ready[job.priority].append(chat_id)
+        self._wakeup.set()
+
+    def _next_chat(self, now: float):
+        """Следующий чат, в который можно отправлять, или время, когда такой появится"""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            chat = self._chats[chat_id]
+            self._ready[chat.jobs[0].priority].append(chat_id)
+
+        for queue in self._ready:
+            while queue:
+                chat_id = queue.popleft()
+                chat = self._chats[chat_id]
+                ready_at = chat.ready_at(now)
+                if ready_at <= now:
+                    return chat_id, None
+                heapq.heappush(self._delayed, (ready_at, next(self._delayed_seq), chat_id))
+
+        return None, self._delayed[0][0] if self._delayed else None
+
+    def _take_jobs(self, chat_id) -> list:
+        """Снимает с очереди чата следующее сообщение и склеиваемые с ним"""
+        chat = self._chats[chat_id]
+        jobs = [chat.jobs.popleft()]
+        while chat.jobs and _can_merge(jobs, chat.jobs[0]):
+            jobs.append(chat.jobs.popleft())
+        chat.tokens -= 1
+        self._depth -= len(jobs)
+        QUEUE_DEPTH.set(value=self._depth)
+
+        if chat.jobs:
+            self._ready[chat.jobs[0].priority].append(chat_id)
+        else:
+            chat.scheduled = False
+        return jobs
+
+    def _sweep(self, now: float):
+        """Забывает чаты, в которые давно ничего не отправляли"""
+        if now - self._last_sweep < CHAT_IDLE_TTL:
+            return
+        self._last_sweep = now
+        idle = [chat_id for chat_id, chat in self._chats.items()
+                if not chat.scheduled and now - chat.updated > CHAT_IDLE_TTL]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    # --- Фоновая отправка ---
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._sweep(now)
+            wait = self._paused_until - now
+            if wait <= 0:
+                self._tokens = min(self.global_rate, self._tokens + (now - self._updated) * self.global_rate)
+                self._updated = now
+                wait = (1 - self._tokens) / self.global_rate
+
+            if wait <= 0:
+                chat_id, ready_at = self._next_chat(now)
+                if chat_id is not None:
+                    self._tokens -= 1
+                    task = asyncio.create_task(self._send(chat_id, self._take_jobs(chat_id)))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+                    continue
+                wait = None if ready_at is None else ready_at - now
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, chat_id, jobs: list):
+        job = jobs[-1]
+        method = job.method
+        if len(jobs) > 1:
+            MERGED.inc(amount=len(jobs) - 1)
+            method = method.model_copy(update={
+                "text": MERGE_SEPARATOR.join(j.method.text for j in jobs)
+            })
+
+        try:
+            response = await job.make_request(job.bot, method)
+        except TelegramRetryAfter as e:
+            RETRY_AFTER.inc()
+            logger.warning("Telegram просит подождать %s с (чат %s)", e.retry_after, chat_id)
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            for j in reversed(jobs):
+                if j.future.done():
+                    continue
+                if j.retries >= MAX_RETRIES:
+                    j.future.set_exception(e)
+                    continue
+                j.retries += 1
+                self._enqueue(chat_id, j, front=True)
+            return
+        except Exception as e:
+            for j in jobs:
+                if not j.future.done():
+                    j.future.set_exception(e)
+            return
+
+        for j in jobs:
+            if not j.future.done():
+                j.future.set_result(response)
+
+
+def _can_merge(jobs: list, candidate: _Job) -> bool:
+    """Можно ли дописать candidate к уже склеенным текстовым сообщениям jobs"""
+    first = jobs[0].method
+    method = candidate.method
+    if type(first) is not SendMessage or type(method) is not SendMessage:
+        return False
+    # Клавиатура может быть только у последнего из склеенных сообщений
+    if jobs[-1].method.reply_markup is not None:
+        return False
+    if first.entities is not None or method.entities is not None:
+        return False
+    if candidate.bot is not jobs[0].bot:
+        return False
+    if first.model_dump(exclude={"text", "reply_markup"}) != method.model_dump(exclude={"text", "reply_markup"}):
+        return False
+
+    length = (sum(text_length(j.method.text) for j in jobs) + text_length(method.text)
+              + text_length(MERGE_SEPARATOR) * len(jobs))
+    return length <= MAX_MESSAGE_LENGTH
+
+
+def text_length(text: str) -> int:
+    """Длина текста так, как её считает Telegram: эмодзи вне BMP занимают две единицы"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def join_texts(texts: list) -> list:
+    """
+    Склеивает тексты в как можно меньше сообщений не длиннее MAX_MESSAGE_LENGTH.
+    Обработчику, у которого несколько ответов сразу, выгоднее отправить их одним
+    сообщением: каждое сообщение в чат расходует лимит чата (около 1 в секунду).
+    """
+    messages = []
+    for text in texts:
+        if messages and text_length(messages[-1]) + text_length(MERGE_SEPARATOR + text) <= MAX_MESSAGE_LENGTH:
+            messages[-1] += MERGE_SEPARATOR + text
+        else:
+            messages.append(text)
+    return messages
+
+
+def install(bot: Bot) -> OutboundScheduler:
+    """Пропускает все исходящие сообщения бота через общую очередь"""
+    scheduler = OutboundScheduler()
+    bot.session.middleware(scheduler)
+    return scheduler
@@ -0,0 +1,167 @@
+"""
+Детектор зависаний цикла событий.
+
+Режим профилирования включается переменной окружения STALL_PROFILE=1.
+Фоновая задача в цикле событий регулярно отмечается (heartbeat), а отдельный
+поток-сторож проверяет, как давно это было. Если цикл не отмечался дольше
+порога (STALL_THRESHOLD_MS, по умолчанию 100 мс), значит его блокирует
+синхронный вызов (requests.get, gTTS, работа с диском) - сторож снимает стек
+потока цикла событий и копит выборки по имени обработчика.
+
+При остановке бота отчёт в формате folded stacks (flamegraph.pl, speedscope)
+пишется в STALL_REPORT (по умолчанию stalls.folded), а в лог выводится
+рейтинг обработчиков по суммарному времени блокировки.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from aiogram import Dispatcher, Router
+
+logger = logging.getLogger(__name__)
+
+STALL_PROFILE = os.getenv("STALL_PROFILE", "") not in ("", "0")
+STALL_THRESHOLD_MS = float(os.getenv("STALL_THRESHOLD_MS") or 100)
+STALL_REPORT = os.getenv("STALL_REPORT") or "stalls.folded"
+
+# Стек без обработчика бота (например, блокирует сам aiogram или middleware)
+UNKNOWN_HANDLER = "<loop>"
+
+
+class StallProfiler:
+    def __init__(self, threshold: float, report_path: str):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.report_path = report_path
+
+        self.handlers = {}  # code object обработчика -> имя
+        self.samples = defaultdict(int)  # (обработчик, стек) -> число выборок
+        self.stalls = defaultdict(lambda: [0, 0.0])  # обработчик -> [число, суммарное время]
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_tick = time.monotonic()
+        self._thread_id = None
+        self._watchdog = None
+        self._heartbeat_task = None
+
+    def collect_handlers(self, router: Router):
+        for observer in router.observers.values():
+            for handler in observer.handlers:
+                code = getattr(handler.callback, "__code__", None)
+                if code is not None:
+                    self.handlers[code] = handler.callback.__name__
+        for sub_router in router.sub_routers:
+            self.collect_handlers(sub_router)
+
+    async def start(self):
+        self._thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("Профилирование зависаний включено, порог %.0f мс", self.threshold * 1000)
+
+    async def stop(self):
+        self._stop.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        if self._watchdog:
+            self._watchdog.join()
+        self.write_report()
+
+    async def _heartbeat(self):
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        stall_started = stall_handler = None
+
+        while not self._stop.wait(self.interval):
+            behind = time.monotonic() - self._last_tick
+            if behind < self.threshold:
+                if stall_started is not None:
+                    self._record_stall(stall_handler, time.monotonic() - stall_started)
+                    stall_started = stall_handler = None
+                continue
+
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            handler, stack = self._describe(frame)
+            with self._lock:
+                self.samples[(handler, stack)] += 1
+
+            if stall_started is None:
+                stall_started = self._last_tick
+            if stall_handler in (None, UNKNOWN_HANDLER):
+                stall_handler = handler
+
+    def _record_stall(self, handler: str, duration: float):
+        with self._lock:
+            stall = self.stalls[handler]
+            stall[0] += 1
+            stall[1] += duration
+
+    def _describe(self, frame):
+        """Возвращает имя обработчика и стек от него до места блокировки"""
+        frames = []
+        handler = UNKNOWN_HANDLER
+        while frame is not None:
+            frames.append(frame)
+            if frame.f_code in self.handlers:
+                handler = self.handlers[frame.f_code]
+                break
+            frame = frame.f_back
+
+        stack = ";".join(
+            f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_lineno})"
+            for f in reversed(frames)
+        )
+        return handler, stack
+
+    def folded(self) -> str:
+        with self._lock:
+            samples = sorted(self.samples.items(), key=lambda item: -item[1])
+        return "".join(f"{handler};{stack} {count}\n" for (handler, stack), count in samples)
+
+    def ranking(self) -> list:
+        """Обработчики по убыванию суммарного времени блокировки цикла событий"""
+        with self._lock:
+            stalls = [(handler, count, total) for handler, (count, total) in self.stalls.items()]
+        return sorted(stalls, key=lambda item: -item[2])
+
+    def write_report(self):
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+
+        for handler, count, total in self.ranking():
+            logger.warning("Блокировка цикла событий: %s - %d раз, всего %.0f мс", handler, count, total * 1000)
+        logger.info("Отчёт о зависаниях сохранён в %s", self.report_path)
+
+
+def install(dp: Dispatcher):
+    """Включает профилирование зависаний, если задан STALL_PROFILE"""
+    if not STALL_PROFILE:
+        return None
+
+    profiler = StallProfiler(STALL_THRESHOLD_MS / 1000, STALL_REPORT)
+
+    async def on_startup(**kwargs):
+        # Обработчики собираем при запуске: к этому моменту все они уже зарегистрированы
+        profiler.collect_handlers(dp)
+        await profiler.start()
+
+    async def on_shutdown(**kwargs):
+        await profiler.stop()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return profiler
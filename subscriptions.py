@@ -0,0 +1,259 @@
+"""
+Ежедневная рассылка прогноза погоды по подписке.
+
+Подписки хранятся в SQLite: (пользователь, город, время отправки). Время
+пользователь задаёт местное, а в таблице оно хранится минутой суток по UTC
+с индексом, так что выборка "кому пора" - это диапазонный запрос по индексу.
+
+Раз в минуту планировщик выбирает подписки, которым пора, группирует их
+по каноническому названию города, запрашивает каждый город ровно один раз
+(не больше fanout запросов одновременно), рендерит сообщение один раз
+на пару (город, язык) и отдаёт готовые тексты на отправку с ограничением
+скорости (в боте - через общую очередь outbound с низким приоритетом).
+Число запросов к API погоды зависит от числа разных городов, а не от числа
+подписчиков.
+"""
+import asyncio
+import itertools
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+
+# Не больше стольких сообщений в секунду при рассылке (None - темп задаёт send)
+SEND_RATE = 25
+
+# Сколько отметок об отправке сохраняем за один executemany
+MARK_BATCH = 1000
+
+_TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+_OFFSET = re.compile(r"^(?:UTC|GMT)?([+-]\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+
+
+class Subscription(NamedTuple):
+    city: str
+    local_time: str
+    utc_offset: int  # минуты
+
+
+def canonical_city(city: str) -> str:
+    """Канонический вид города: по нему группируются подписки"""
+    return " ".join(city.split()).lower()
+
+
+def parse_subscription(text: str, default_offset: int) -> Optional[Subscription]:
+    """
+    Разбирает аргументы /subscribe: "<город> <ЧЧ:ММ> [UTC±Ч]".
+    Город может состоять из нескольких слов, поэтому разбираем с конца.
+    """
+    tokens = text.split()
+    offset = default_offset
+    if tokens and _OFFSET.match(tokens[-1]) and len(tokens) > 2:
+        hours, minutes = _OFFSET.match(tokens.pop()).groups()
+        offset = int(hours) * 60 + (int(minutes or 0) if int(hours) >= 0 else -int(minutes or 0))
+
+    if len(tokens) < 2 or not _TIME.match(tokens[-1]):
+        return None
+    hours, minutes = map(int, _TIME.match(tokens.pop()).groups())
+    if hours > 23 or minutes > 59 or not -14 * 60 <= offset <= 14 * 60:
+        return None
+
+    return Subscription(" ".join(tokens), f"{hours:02d}:{minutes:02d}", offset)
+
+
+def utc_minute(local_time: str, utc_offset: int) -> int:
+    hours, minutes = map(int, local_time.split(":"))
+    return (hours * 60 + minutes - utc_offset) % MINUTES_PER_DAY
+
+
+class SubscriptionScheduler:
+    def __init__(self, connect: Callable, fetch: Callable, render: Callable, send: Callable,
+                 fanout: int = 4, send_rate: float = SEND_RATE):
+        """
+        connect() - асинхронное соединение с БД (async with connect() as db);
+        fetch(city) - ответ API погоды по городу;
+        render(city, data, lang) - текст сообщения;
+        send(user_id, text) - отправка сообщения пользователю.
+        """
+        self.connect = connect
+        self.fetch = fetch
+        self.render = render
+        self.send = send
+        self.fanout = fanout
+        self.send_rate = send_rate
+        self._next_slot = 0.0
+        self._last_minute = None
+
+    async def init_db(self):
+        async with self.connect() as db:
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    user_id INTEGER NOT NULL,
+                    city TEXT NOT NULL,            -- как ввёл пользователь
+                    city_key TEXT NOT NULL,        -- канонический вид для группировки
+                    local_time TEXT NOT NULL,      -- ЧЧ:ММ по местному времени
+                    utc_offset INTEGER NOT NULL,   -- смещение местного времени, минуты
+                    send_minute INTEGER NOT NULL,  -- минута суток отправки по UTC
+                    lang TEXT NOT NULL DEFAULT 'ru',
+                    last_sent TEXT,                -- дата последней отправки (UTC)
+                    PRIMARY KEY (user_id, city_key)
+                )
+            ''')
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS subscriptions_due ON subscriptions (send_minute, city_key)'
+            )
+            await db.commit()
+
+    async def subscribe(self, user_id: int, subscription: Subscription, lang: str = "ru"):
+        async with self.connect() as db:
+            await db.execute(
+                'INSERT OR REPLACE INTO subscriptions '
+                '(user_id, city, city_key, local_time, utc_offset, send_minute, lang) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (user_id, subscription.city, canonical_city(subscription.city), subscription.local_time,
+                 subscription.utc_offset, utc_minute(subscription.local_time, subscription.utc_offset), lang)
+            )
+            await db.commit()
+
+    async def unsubscribe(self, user_id: int, city: str = None) -> int:
+        async with self.connect() as db:
+            if city:
+                cursor = await db.execute('DELETE FROM subscriptions WHERE user_id = ? AND city_key = ?',
+                                          (user_id, canonical_city(city)))
+            else:
+                cursor = await db.execute('DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+            await db.commit()
+            return cursor.rowcount
+
+    async def list_for_user(self, user_id: int) -> list:
+        async with self.connect() as db:
+            cursor = await db.execute(
+                'SELECT city, local_time, utc_offset FROM subscriptions WHERE user_id = ? ORDER BY local_time',
+                (user_id,)
+            )
+            return [Subscription(*row) for row in await cursor.fetchall()]
+
+    async def run(self):
+        """Раз в минуту рассылает прогнозы тем, кому пора"""
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                await self.tick(now)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки прогнозов: {e}")
+            next_minute = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            await asyncio.sleep(max(0.0, (next_minute - datetime.now(timezone.utc)).total_seconds()))
+
+    async def tick(self, now: datetime):
+        minute = now.hour * 60 + now.minute
+        today = now.date().isoformat()
+        if minute == self._last_minute:
+            return
+
+        # Если тик опоздал (например, долго шла прошлая рассылка), догоняем пропущенные минуты.
+        # Каждый диапазон минут относится к своей дате: минуты до полуночи - ко вчерашней.
+        first = minute if self._last_minute is None else (self._last_minute + 1) % MINUTES_PER_DAY
+        self._last_minute = minute
+        if first <= minute:
+            ranges = [(first, minute, today)]
+        else:
+            yesterday = (now.date() - timedelta(days=1)).isoformat()
+            ranges = [(first, MINUTES_PER_DAY - 1, yesterday), (0, minute, today)]
+
+        due = await self._due(ranges)
+        if not due:
+            return
+
+        started = time.perf_counter()
+        messages = await self._render(due)
+        sent = await self._deliver(due, messages)
+        logger.info("Рассылка прогнозов: %d городов, %d сообщений за %.1f с",
+                    len(due), sent, time.perf_counter() - started)
+
+    async def _due(self, ranges: list) -> dict:
+        """
+        Подписки, которым пора, по диапазонам (минута с, минута по, дата):
+        город -> [(user_id, lang, город как ввёл пользователь, дата отправки)]
+        """
+        due = defaultdict(list)
+        async with self.connect() as db:
+            for low, high, date in ranges:
+                cursor = await db.execute(
+                    'SELECT city_key, user_id, lang, city FROM subscriptions '
+                    'WHERE send_minute BETWEEN ? AND ? AND (last_sent IS NULL OR last_sent <> ?)',
+                    (low, high, date)
+                )
+                async for city_key, user_id, lang, city in cursor:
+                    due[city_key].append((user_id, lang, city, date))
+        return due
+
+    async def _render(self, due: dict) -> dict:
+        """Запрашивает каждый город один раз и рендерит текст на каждую пару (город, язык)"""
+        semaphore = asyncio.Semaphore(self.fanout)
+
+        async def render_city(city_key, subscribers):
+            city = subscribers[0][2]
+            async with semaphore:
+                try:
+                    data = await self.fetch(city)
+                except Exception as e:
+                    logger.error(f"Не удалось получить прогноз для рассылки ({city}): {e}")
+                    return {}
+            langs = {lang for _, lang, _, _ in subscribers}
+            return {(city_key, lang): self.render(city, data, lang) for lang in langs}
+
+        messages = {}
+        for rendered in await asyncio.gather(*(render_city(key, subs) for key, subs in due.items())):
+            messages.update(rendered)
+        return messages
+
+    async def _deliver(self, due: dict, messages: dict) -> int:
+        """
+        Отправляет готовые тексты пачками по MARK_BATCH сообщений: внутри пачки
+        сообщения уходят параллельно, а темп задаёт send (общая очередь outbound)
+        и, если указан send_rate, сам планировщик.
+        """
+        pending = (
+            (user_id, city_key, date, messages[(city_key, lang)])
+            for city_key, subscribers in due.items()
+            for user_id, lang, _, date in subscribers
+            # Город, который не удалось получить, сегодня пропускаем
+            if (city_key, lang) in messages
+        )
+
+        sent = 0
+        while batch := list(itertools.islice(pending, MARK_BATCH)):
+            results = await asyncio.gather(*(self._send_one(user_id, text) for user_id, _, _, text in batch))
+            delivered = [(date, user_id, city_key) for (user_id, city_key, date, _), ok in zip(batch, results) if ok]
+            await self._mark_sent(delivered)
+            sent += len(delivered)
+        return sent
+
+    async def _send_one(self, user_id: int, text: str) -> bool:
+        if self.send_rate:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + 1 / self.send_rate
+            await asyncio.sleep(slot - now)
+
+        try:
+            await self.send(user_id, text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить прогноз пользователю {user_id}: {e}")
+            return False
+        return True
+
+    async def _mark_sent(self, delivered: list):
+        if not delivered:
+            return
+        async with self.connect() as db:
+            await db.executemany(
+                'UPDATE subscriptions SET last_sent = ? WHERE user_id = ? AND city_key = ?', delivered
+            )
+            await db.commit()
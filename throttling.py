@@ -0,0 +1,184 @@
+"""
+Ограничение частоты запросов, которые упираются в сторонние API.
+
+ThrottlingMiddleware держит token bucket на каждую пару (пользователь, обработчик)
+и ограничивает число одновременных обращений к каждому upstream. Запрос сверх
+лимита не ставится в очередь: пользователь сразу получает короткий ответ
+или последний сохранённый ответ (fallback правила).
+
+Правила задаются по имени обработчика, как и метрики:
+
+    throttling.install(dp, {
+        "exchange_rates": throttling.Rule(rate=1 / 10, burst=3, upstream="exchange"),
+    }, upstream_limits={"exchange": 5})
+
+Если один вызов обработчика делает несколько запросов к upstream (прогноз по
+нескольким городам), правилу ставится quota=True: middleware пропускает вызов,
+пока в корзине есть хотя бы один токен, а обработчик сам списывает по токену
+на каждый запрос через аргумент quota (Quota.take).
+"""
+import os
+import time
+from typing import Callable, NamedTuple, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import CallbackQuery, Message
+
+import metrics
+
+# THROTTLING=0 отключает ограничения (например, для нагрузочного теста)
+THROTTLING = os.getenv("THROTTLING", "1") not in ("", "0")
+
+THROTTLED_TEXT = "⏳ Слишком много запросов. Попробуйте чуть позже."
+BUSY_TEXT = "⏳ Сервис сейчас перегружен. Попробуйте чуть позже."
+
+# Корзины, к которым не обращались дольше этого времени, удаляются
+IDLE_TTL = 600
+
+THROTTLED = metrics.Counter("bot_throttled_total", "Запросы, отклонённые ограничением частоты",
+                            ("handler", "reason"))
+metrics.REGISTRY.append(THROTTLED)
+
+
+class Rule(NamedTuple):
+    rate: float  # токенов в секунду
+    burst: int  # ёмкость корзины
+    upstream: Optional[str] = None
+    # Последний ответ, который можно отдать вместо запроса к upstream
+    fallback: Optional[Callable[[object], Optional[str]]] = None
+    # Токены списывает сам обработчик (аргумент quota), по числу запросов к upstream
+    quota: bool = False
+
+
+class Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, rule: Rule, now: float):
+        self.tokens = min(rule.burst, self.tokens + (now - self.updated) * rule.rate)
+        self.updated = now
+
+    def take(self, rule: Rule, now: float) -> bool:
+        self.refill(rule, now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def take_up_to(self, rule: Rule, now: float, count: int) -> int:
+        """Списывает до count токенов, возвращает, сколько удалось"""
+        self.refill(rule, now)
+        taken = max(0, min(count, int(self.tokens)))
+        self.tokens -= taken
+        return taken
+
+
+class Quota:
+    """Корзина пользователя, из которой обработчик сам списывает токены за запросы к upstream"""
+
+    __slots__ = ("bucket", "rule", "handler")
+
+    def __init__(self, bucket: Bucket, rule: Rule, handler: str):
+        self.bucket = bucket
+        self.rule = rule
+        self.handler = handler
+
+    def take(self, count: int) -> int:
+        """Сколько из count запросов пользователю разрешено сделать сейчас"""
+        taken = self.bucket.take_up_to(self.rule, time.monotonic(), count)
+        if taken < count:
+            THROTTLED.inc(self.handler, "user", amount=count - taken)
+        return taken
+
+
+class UpstreamLimit:
+    """Потолок одновременных обращений к upstream без очереди ожидания"""
+
+    __slots__ = ("limit", "active")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+    def try_acquire(self) -> bool:
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, rules: dict, upstream_limits: dict = None, idle_ttl: float = IDLE_TTL):
+        self.rules = rules
+        self.upstreams = {name: UpstreamLimit(limit) for name, limit in (upstream_limits or {}).items()}
+        self.idle_ttl = idle_ttl
+        self.buckets = {}  # (user_id, обработчик) -> Bucket
+        self._last_sweep = time.monotonic()
+
+    async def __call__(self, handler, event, data):
+        name = metrics.handler_name(data)
+        rule = self.rules.get(name)
+        user = data.get("event_from_user")
+        if rule is None or user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._sweep(now)
+
+        key = (user.id, name)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(rule.burst, now)
+        if rule.quota:
+            bucket.refill(rule, now)
+            if bucket.tokens < 1:
+                THROTTLED.inc(name, "user")
+                return await self._reject(event, rule, THROTTLED_TEXT)
+            data["quota"] = Quota(bucket, rule, name)
+        elif not bucket.take(rule, now):
+            THROTTLED.inc(name, "user")
+            return await self._reject(event, rule, THROTTLED_TEXT)
+
+        limit = self.upstreams.get(rule.upstream)
+        if limit is None:
+            return await handler(event, data)
+        if not limit.try_acquire():
+            THROTTLED.inc(name, "upstream")
+            return await self._reject(event, rule, BUSY_TEXT)
+        try:
+            return await handler(event, data)
+        finally:
+            limit.release()
+
+    def _sweep(self, now: float):
+        if now - self._last_sweep < self.idle_ttl:
+            return
+        self._last_sweep = now
+        deadline = now - self.idle_ttl
+        for key in [key for key, bucket in self.buckets.items() if bucket.updated < deadline]:
+            del self.buckets[key]
+
+    @staticmethod
+    async def _reject(event, rule: Rule, text: str):
+        cached = rule.fallback(event) if rule.fallback else None
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, Message):
+            await event.answer(cached or text)
+
+
+def install(dp: Dispatcher, rules: dict, upstream_limits: dict = None) -> Optional[ThrottlingMiddleware]:
+    """Подключает ограничение частоты к сообщениям и нажатиям кнопок"""
+    if not THROTTLING:
+        return None
+
+    middleware = ThrottlingMiddleware(rules, upstream_limits)
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    return middleware